@@ -0,0 +1,101 @@
+"""Chunking time and chunk sizes on synthetic 500-page documents: old paragraph splitter vs. services.chunking.
+
+Two inputs are generated: PDF-like text (single newlines, no blank lines,
+as PyPDF2 produces) and text with many short, partly repeated paragraphs.
+
+    python benchmarks/chunking_benchmark.py --pages 500 --runs 3
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.chunking import chunk_document  # noqa: E402
+from services.pdf_extraction import join_pages  # noqa: E402
+from services.tokens import estimate_tokens  # noqa: E402
+
+WORDS = ("the model retrieval document answer context question summary page token index vector "
+         "latency cache memory chunk overlap offset parser section student notes lecture").split()
+
+
+def paragraph_split_chunks(extracted_text: str, filename: str):
+    """The previous chunker: split on blank lines and locate each paragraph with str.find"""
+    chunks = []
+    for i, paragraph in enumerate(extracted_text.split('\n\n')):
+        if paragraph.strip():
+            chunks.append({
+                'text': paragraph.strip(),
+                'paragraph_index': i,
+                'section': f"Paragraph {i+1}",
+                'document': filename,
+                'char_start': extracted_text.find(paragraph),
+                'char_end': extracted_text.find(paragraph) + len(paragraph)
+            })
+    return chunks
+
+
+def sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "."
+
+
+def pdf_like_pages(pages: int, rng: random.Random):
+    """~3000 characters per page, wrapped into lines without blank lines between paragraphs"""
+    page_texts = []
+    for _ in range(pages):
+        text = " ".join(sentence(rng) for _ in range(25))
+        page_texts.append("\n".join(text[i:i + 90] for i in range(0, len(text), 90)))
+    return page_texts
+
+
+def paragraph_pages(pages: int, rng: random.Random):
+    """Blank-line separated paragraphs; every tenth one repeats an earlier paragraph"""
+    seen = []
+    page_texts = []
+    for _ in range(pages):
+        paragraphs = []
+        for _ in range(8):
+            if seen and rng.random() < 0.1:
+                paragraphs.append(rng.choice(seen))
+            else:
+                paragraph = " ".join(sentence(rng) for _ in range(3))
+                seen.append(paragraph)
+                paragraphs.append(paragraph)
+        page_texts.append("\n\n".join(paragraphs))
+    return page_texts
+
+
+def measure(chunker, *args, runs: int):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        chunks = chunker(*args)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'input':<11} {'chunker':<10} {'median s':>9} {'chunks':>7} {'max tok':>8} {'mean tok':>9} {'bad offsets':>11}")
+    for label, page_texts in (("pdf-like", pdf_like_pages(args.pages, rng)), ("paragraphs", paragraph_pages(args.pages, rng))):
+        text, pages = join_pages(page_texts)
+        for name, chunker, extra in (("old", paragraph_split_chunks, ()), ("new", chunk_document, (pages,))):
+            seconds, chunks = measure(chunker, text, "bench.pdf", *extra, runs=args.runs)
+            tokens = [estimate_tokens(chunk['text']) for chunk in chunks]
+            # Offsets that do not advance point at an earlier copy of a repeated paragraph
+            bad_offsets = sum(1 for previous, chunk in zip(chunks, chunks[1:]) if chunk['char_start'] <= previous['char_start'])
+            print(f"{label:<11} {name:<10} {seconds:>9.4f} {len(chunks):>7} {max(tokens):>8} "
+                  f"{statistics.mean(tokens):>9.1f} {bad_offsets:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Requests/second of the backend under parallel load, with storage calls inline vs. on the I/O pool.
+
+Runs the real FastAPI app in-process against the SQLite backend and adds a
+fixed sleep to every storage call to stand in for a Firestore round-trip.
+The document cache is disabled so every request pays that latency.
+
+    python benchmarks/concurrency_benchmark.py --requests 200 --concurrency 50 --latency-ms 50
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_latency(storage, latency_seconds: float) -> None:
+    """Wrap every public storage method with a blocking sleep, like a synchronous network client"""
+    for name in dir(storage):
+        if name.startswith('_'):
+            continue
+        method = getattr(storage, name)
+        if not callable(method):
+            continue
+
+        def wrapped(*args, __method=method, **kwargs):
+            time.sleep(latency_seconds)
+            return __method(*args, **kwargs)
+
+        setattr(storage, name, wrapped)
+
+
+async def run_load(args) -> dict:
+    import httpx
+    import main
+
+    document_id = "bench_document.txt"
+    main.storage.save_document("bench", {
+        "id": document_id,
+        "original_name": "bench_document.txt",
+        "file_type": "text/plain",
+        "file_size": 11,
+        "file_path": "",
+        "extracted_text": "hello world",
+        "uploaded_at": "2024-01-01T00:00:00"
+    })
+    # main.storage is the metrics wrapper; the sleeps go on the backend it times
+    add_latency(main.storage.storage, args.latency_ms / 1000.0)
+
+    transport = httpx.ASGITransport(app=main.app)
+    headers = {"Authorization": "Bearer bench"}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one_request():
+            async with semaphore:
+                response = await client.get(f"/api/documents/{document_id}", headers=headers)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    return {"seconds": round(elapsed, 3), "rps": round(args.requests / elapsed, 1)}
+
+
+def run_child(args, workers: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "STORAGE_BACKEND": "sqlite",
+            "SQLITE_PATH": os.path.join(tmp, "bench.db"),
+            "LOCAL_AUTH_UID": "bench",
+            "DEEPSEEK_API_KEY": os.getenv("DEEPSEEK_API_KEY", "benchmark"),
+            "DOCUMENT_CACHE_MAX_ENTRIES": "0",
+            "VECTOR_STORE_DIR": os.path.join(tmp, "vectors"),
+            "BLOCKING_IO_WORKERS": str(workers),
+        }
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child",
+             "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+             "--latency-ms", str(args.latency_ms)],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--workers", type=int, default=32, help="BLOCKING_IO_WORKERS for the offloaded run")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, BACKEND_DIR)
+        print(json.dumps(asyncio.run(run_load(args))))
+        return
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.latency_ms:g} ms per storage call")
+    for label, workers in (("inline (blocking)", 0), (f"I/O pool ({args.workers} threads)", args.workers)):
+        result = run_child(args, workers)
+        print(f"  {label:<28} {result['seconds']:>8.3f} s  {result['rps']:>8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
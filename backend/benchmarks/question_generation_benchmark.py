@@ -0,0 +1,64 @@
+"""Wall time and token usage of per-chunk (parallel) vs. batched quiz generation.
+
+Calls the real DeepSeek API, so DEEPSEEK_API_KEY must be set. The input is a
+plain-text file, chunked with chunk_document the same way uploads are.
+
+    python benchmarks/question_generation_benchmark.py notes.txt --questions 3 5 10 --runs 2
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.chunking import chunk_document  # noqa: E402
+from services.process_factory import ProcessFactory, create_http_client  # noqa: E402
+
+
+def load_document(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    filename = os.path.basename(path)
+    return {"original_name": filename, "chunks": chunk_document(text, filename)}
+
+
+async def run(args):
+    factory = ProcessFactory(None, http_client=create_http_client())
+    document = load_document(args.path)
+
+    print(f"{args.path}: {len(document['chunks'])} chunks, {args.runs} run(s) per setting")
+    print(f"{'questions':>9}  {'mode':<9} {'wall s':>8} {'prompt tok':>11} {'compl tok':>10} {'generated':>9}")
+    try:
+        for num_questions in args.questions:
+            for mode in ("parallel", "batched"):
+                times, prompt_tokens, completion_tokens, generated = [], [], [], []
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    result = await factory.generate_questions_from_document(document, args.difficulty, num_questions, mode=mode)
+                    times.append(time.perf_counter() - started)
+                    usage = result.get("usage", {})
+                    prompt_tokens.append(usage.get("prompt_tokens", 0))
+                    completion_tokens.append(usage.get("completion_tokens", 0))
+                    generated.append(result.get("total_generated", 0))
+
+                print(f"{num_questions:>9}  {mode:<9} {statistics.mean(times):>8.2f} "
+                      f"{statistics.mean(prompt_tokens):>11.0f} {statistics.mean(completion_tokens):>10.0f} "
+                      f"{statistics.mean(generated):>9.1f}")
+    finally:
+        await factory.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="Plain-text document to generate questions from")
+    parser.add_argument("--questions", type=int, nargs="+", default=[3, 5, 10])
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--difficulty", default="medium")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
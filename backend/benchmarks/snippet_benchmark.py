@@ -0,0 +1,110 @@
+"""Supporting-snippet extraction: the old fuzz loop vs. shingle alignment (services.alignment).
+
+Answers are built from sentences of the context chunks, half verbatim and
+half lightly paraphrased (words dropped), so every answer sentence has a
+known source span. "found" counts sources whose snippet overlaps that span.
+
+    python benchmarks/snippet_benchmark.py --chunks 5 --runs 5
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+from fuzzywuzzy import fuzz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.alignment import best_alignment, response_sentences  # noqa: E402
+
+# A Zipf-like vocabulary: a few very common words and a long tail, roughly like prose
+WORDS = [f"w{rank}" for rank in range(1, 2001)]
+WEIGHTS = [1 / rank for rank in range(1, 2001)]
+
+
+def fuzz_snippets(ai_response: str, chunks):
+    """The previous per-character fuzz.partial_ratio scan, returning (chunk index, snippet span) pairs"""
+    found = []
+    response_sentences_ = ai_response.split('. ')
+    for index, chunk_text in enumerate(chunks):
+        best_match_score = 0
+        best_start = None
+        for sentence in response_sentences_:
+            if len(sentence.strip()) < 20:
+                continue
+            similarity = fuzz.partial_ratio(sentence.lower(), chunk_text.lower())
+            if similarity > best_match_score and similarity > 60:
+                best_match_score = similarity
+                words = sentence.lower().split()
+                for i in range(len(chunk_text) - 100):
+                    snippet = chunk_text[i:i+200]
+                    if fuzz.partial_ratio(' '.join(words[:5]), snippet.lower()) > 70:
+                        best_start = (i, i + 200)
+                        break
+        if best_match_score > 60:
+            found.append((index, best_start))
+    return found
+
+
+def shingle_snippets(ai_response: str, chunks):
+    found = []
+    sentences = response_sentences(ai_response)
+    for index, chunk_text in enumerate(chunks):
+        alignment = best_alignment(sentences, chunk_text)
+        if alignment:
+            found.append((index, (alignment['char_start'], alignment['char_end'])))
+    return found
+
+
+def make_case(rng: random.Random, num_chunks: int, chunk_sentences: int):
+    chunks, sources = [], []
+    for _ in range(num_chunks):
+        sentences = [" ".join(rng.choices(WORDS, WEIGHTS, k=rng.randint(10, 18))).capitalize() + "."
+                     for _ in range(chunk_sentences)]
+        chunks.append(" ".join(sentences))
+        sources.append(sentences)
+
+    answer, truth = [], {}
+    for index in rng.sample(range(num_chunks), k=max(1, num_chunks // 2)):
+        sentence = rng.choice(sources[index])
+        start = chunks[index].index(sentence)
+        truth[index] = (start, start + len(sentence))
+        if rng.random() < 0.5:
+            words = sentence.rstrip(".").split()
+            sentence = " ".join(word for word in words if rng.random() > 0.2) + "."
+        answer.append(sentence + " [Reference 1]")
+    return " ".join(answer), chunks, truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5, help="Context chunks per answer (RETRIEVAL_TOP_K)")
+    parser.add_argument("--chunk-sentences", type=int, default=15, help="Sentences per chunk (~1.5k characters at 15)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = [make_case(rng, args.chunks, args.chunk_sentences) for _ in range(args.runs)]
+    total_sources = sum(len(truth) for _, _, truth in cases)
+
+    print(f"{args.runs} answers, {args.chunks} chunks each, {total_sources} true sources")
+    print(f"{'method':<9} {'median ms':>10} {'found':>7} {'spurious':>9}")
+    for name, method in (("fuzz", fuzz_snippets), ("shingles", shingle_snippets)):
+        times, found, spurious = [], 0, 0
+        for answer, chunks, truth in cases:
+            started = time.perf_counter()
+            results = method(answer, chunks)
+            times.append((time.perf_counter() - started) * 1000)
+            for index, span in results:
+                if index not in truth:
+                    spurious += 1
+                elif span and span[0] < truth[index][1] and truth[index][0] < span[1]:
+                    found += 1
+        print(f"{name:<9} {statistics.median(times):>10.2f} {found:>7} {spurious:>9}")
+
+
+if __name__ == "__main__":
+    main()
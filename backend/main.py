@@ -9,11 +9,25 @@ from dotenv import load_dotenv
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 from datetime import datetime
+from contextlib import asynccontextmanager
 from enum import Enum
-from services.process_factory import ProcessFactory
+from services.process_factory import ProcessFactory, RETRIEVAL_MODE, SUMMARY_PROMPT_VERSION, create_http_client
+from services.search_index import index_registry
+from services.vector_store import vector_registry
+from services.storage import STORAGE_BACKEND, create_storage
+from services.cache import LRUCache
+from services.concurrency import run_blocking, shutdown_executor
+from services.jobs import JobStore, JobQueue, PermanentJobError
+from services.pdf_extraction import UnreadablePdfError, extract_pdf, shutdown_pdf_pool
+from services.artifacts import artifact_store
+from services.chunking import CHUNKER_VERSION, chunk_document
+from services.answer_cache import answer_cache
+from services.token_verifier import TokenVerifier
+from services.sessions import ChatSessions
+from services.metrics import InstrumentedStorage, MetricsMiddleware, render_metrics, time_stage
 import shutil
-import PyPDF2
-import io
+import mmap
+import hashlib
 import json
 import logging
 
@@ -30,12 +44,59 @@ load_dotenv()
 # cred = credentials.Certificate("firebase-credentials.json")
 # firebase_admin.initialize_app(cred)
 firebase_creds = os.getenv("FIREBASE_CREDENTIALS")
-cred = credentials.Certificate(json.loads(firebase_creds))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+db = None
+firebase_project_id = os.getenv("FIREBASE_PROJECT_ID")
+if firebase_creds:
+    cred = credentials.Certificate(json.loads(firebase_creds))
+    firebase_project_id = firebase_project_id or cred.project_id
+    firebase_admin.initialize_app(cred)
+    if STORAGE_BACKEND == "firestore":
+        db = firestore.client()
+elif STORAGE_BACKEND == "firestore":
+    raise ValueError("FIREBASE_CREDENTIALS not found in environment variables")
+
+# Persistence goes through the configured storage backend (Firestore or local SQLite), timed per call
+storage = InstrumentedStorage(create_storage(db))
+
+# ID tokens are verified locally against cached Google certs and remembered until they expire
+token_verifier = TokenVerifier(firebase_project_id, fallback=auth.verify_id_token)
+
+# Offline runs against SQLite can skip Firebase auth and act as a fixed user
+LOCAL_AUTH_UID = os.getenv("LOCAL_AUTH_UID") if STORAGE_BACKEND == "sqlite" else None
+
+# Upload post-processing (extraction, chunking, indexing) runs on a background job queue
+job_queue = JobQueue(JobStore())
+PRESUMMARIZE_UPLOADS = os.getenv("PRESUMMARIZE_UPLOADS", "false").lower() == "true"
+
+# Per-process cache of document reads; writes in this process invalidate it, other workers see changes after the TTL
+document_cache = LRUCache(
+    max_entries=int(os.getenv("DOCUMENT_CACHE_MAX_ENTRIES", "1000")),
+    max_bytes=int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", "300"))
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """One ProcessFactory (and pooled LLM client) per worker, closed on shutdown"""
+    app.state.process_factory = ProcessFactory(db, http_client=create_http_client(), storage=storage)
+    app.state.chat_sessions = ChatSessions(storage, app.state.process_factory.summarize_conversation)
+    job_queue.start()
+    token_verifier.start()
+    try:
+        yield
+    finally:
+        await job_queue.stop()
+        await token_verifier.aclose()
+        await app.state.chat_sessions.aclose()
+        await app.state.process_factory.aclose()
+        shutdown_executor()
+        shutdown_pdf_pool()
 
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+# Per-route latency and in-flight requests for /metrics
+app.add_middleware(MetricsMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -49,6 +110,8 @@ app.add_middleware(
 class QuestionGenerationRequest(BaseModel):
     document_id: str
     difficulty_level: Optional[str] = "medium"  # easy, medium, hard
+    num_questions: Optional[int] = 3
+    generation_mode: Optional[str] = "parallel"  # parallel (one call per question) or batched (one call total)
 
 class AnswerEvaluationRequest(BaseModel):
     question_id: str
@@ -71,16 +134,31 @@ class MessageRequest(BaseModel):
     role: Role
     document_id: str
     content: str
-    conversation_history: Optional[List[Dict]] = []
+    conversation_history: Optional[List[Dict]] = []  # Ignored when session_id is given
+    session_id: Optional[str] = None  # Server-side chat session from /api/sessions; history is kept by the server
+    top_k: Optional[int] = None  # Chunks of document context; defaults to RETRIEVAL_TOP_K
+    context_token_budget: Optional[int] = None  # Defaults to CONTEXT_TOKEN_BUDGET
+    stream: Optional[bool] = False  # Stream the answer as Server-Sent Events
+
+class SessionCreateRequest(BaseModel):
+    document_id: str
 
 # Create uploads directory if it doesn't exist
 UPLOAD_DIR = "uploads"
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))  # Uploads are copied to disk this much at a time
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # Mount the uploads directory to serve static files
 # Files will be accessible at /static/filename.pdf
 app.mount("/static", StaticFiles(directory=UPLOAD_DIR), name="static")
 
+def get_process_factory(request: Request) -> ProcessFactory:
+    """Shared ProcessFactory created in the app lifespan"""
+    return request.app.state.process_factory
+
+def get_chat_sessions(request: Request) -> ChatSessions:
+    return request.app.state.chat_sessions
+
 # Dependency to verify Firebase token
 async def verify_token(request: Request):
     """Verify Firebase ID token from Authorization header"""
@@ -90,49 +168,44 @@ async def verify_token(request: Request):
             raise HTTPException(status_code=401, detail="No valid authorization header")
         
         token = auth_header.split(' ')[1]
-        decoded_token = auth.verify_id_token(token)
+        if LOCAL_AUTH_UID:
+            return {'uid': LOCAL_AUTH_UID, 'token': token}
+        decoded_token = await token_verifier.verify(token)
         
         return {'uid': decoded_token['uid'], 'token': token}
     except Exception as e:
         logger.error(f"Token verification failed: {e}")
         raise HTTPException(status_code=401, detail=str(e))
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extract text from PDF file"""
-    try:
-        pdf_file = io.BytesIO(file_content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        text = ""
-        for page in pdf_reader.pages:
-            # Ensure page.extract_text() returns a string or handle None
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-        
-        return text.strip()
-    except Exception as e:
-        logger.error(f"Error extracting text from PDF: {e}")
-        raise HTTPException(status_code=400, detail=f"Error extracting text from PDF: {str(e)}")
-
-def chunk_document_with_metadata(extracted_text: str, filename: str) -> List[Dict]:
-    """Enhanced chunking with paragraph/section tracking"""
-    chunks = []
-    paragraphs = extracted_text.split('\n\n')
-    
-    for i, paragraph in enumerate(paragraphs):
-        if paragraph.strip():
-            chunks.append({
-                'text': paragraph.strip(),
-                'paragraph_index': i,
-                'section': f"Paragraph {i+1}",
-                'document': filename,
-                'char_start': extracted_text.find(paragraph),
-                'char_end': extracted_text.find(paragraph) + len(paragraph)
-            })
-    
+def build_document_chunks(content_hash: Optional[str], extracted_text: str, filename: str, pages: List[Dict] = None) -> List[Dict]:
+    """Chunk a document, reusing the chunks of an identical earlier upload (with this upload's file name)"""
+    artifact_name = f"chunks-{CHUNKER_VERSION}"
+    cached = artifact_store.load_json(content_hash, artifact_name) if content_hash else None
+    if cached is not None:
+        return [{**chunk, 'document': filename} for chunk in cached]
+
+    with time_stage("chunking"):
+        chunks = chunk_document(extracted_text, filename, pages)
+    if content_hash:
+        artifact_store.save_json(content_hash, artifact_name, chunks)
     return chunks
 
+def document_embeddings(document_data: Dict):
+    """Chunk embeddings for a document, cached by content hash, chunker and embedder"""
+    content_hash = document_data.get('content_hash')
+    chunks = document_data.get('chunks')
+    if not content_hash or not chunks:
+        return None
+
+    embedder = vector_registry.embedder
+    artifact_name = f"embeddings-{CHUNKER_VERSION}-{embedder.name}-{embedder.dimension}"
+    vectors = artifact_store.load_array(content_hash, artifact_name)
+    if vectors is None or len(vectors) != len(chunks):
+        with time_stage("embedding"):
+            vectors = embedder.embed([chunk.get('text', '') for chunk in chunks])
+        artifact_store.save_array(content_hash, artifact_name, vectors)
+    return vectors
+
 def save_chunked_document(user_id: str, document_data: Dict, chunks: List[Dict]):
     """Save document with chunks for better retrieval"""
     try:
@@ -146,51 +219,261 @@ def save_chunked_document(user_id: str, document_data: Dict, chunks: List[Dict])
     except Exception as e:
         logger.error(f"Error saving chunked document: {e}")
 
+def invalidate_user_documents(user_id: str, document_id: str = None) -> None:
+    """Drop cached reads affected by a write to the user's documents"""
+    for include_content in (False, True):
+        document_cache.invalidate(('documents', user_id, include_content))
+        if document_id:
+            document_cache.invalidate(('document', user_id, document_id, include_content))
+
+async def stream_upload(file: UploadFile, file_path: str) -> Dict:
+    """Copy an upload to disk in UPLOAD_CHUNK_BYTES pieces, hashing as it goes, so it is never fully in memory"""
+    digest = hashlib.sha256()
+    size = 0
+    out = await run_blocking(open, file_path, "wb")
+    try:
+        while True:
+            block = await file.read(UPLOAD_CHUNK_BYTES)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+            await run_blocking(out.write, block)
+    except Exception:
+        await run_blocking(out.close)
+        await run_blocking(os.remove, file_path)
+        raise
+    await run_blocking(out.close)
+    return {'size': size, 'sha256': digest.hexdigest()}
+
+def read_text_upload(file_path: str) -> str:
+    """Decode a stored text upload straight from a memory map"""
+    if os.path.getsize(file_path) == 0:
+        return ""
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return str(mapped, 'utf-8')
+
+def index_user_document(user_id: str, document_data: Dict) -> None:
+    """Add a new document's chunks to the user's retrieval indexes"""
+    index_registry.add_document(user_id, document_data)
+    answer_cache.invalidate_tag(document_data['id'])
+    if RETRIEVAL_MODE != "lexical":
+        vector_registry.add_document(user_id, document_data, vectors=document_embeddings(document_data))
+
+def unindex_user_document(user_id: str, document_id: str) -> None:
+    index_registry.remove_document(user_id, document_id)
+    answer_cache.invalidate_tag(document_id)
+    if RETRIEVAL_MODE != "lexical":
+        vector_registry.remove_document(user_id, document_id)
+
+def save_user_document(user_id: str, document_data: Dict, only_if_exists: bool = False) -> bool:
+    """Save one document record; errors propagate to the caller"""
+    saved = storage.save_document(user_id, document_data, only_if_exists=only_if_exists)
+    invalidate_user_documents(user_id, document_data['id'])
+    return saved
+
 def save_user_documents(user_id: str, documents: List[Dict]) -> None:
-    """Save user documents to Firestore"""
+    """Save user documents, one document record at a time"""
     try:
-        user_doc_ref = db.collection('user_documents').document(user_id)
-        
-        # Get existing documents
-        existing_doc = user_doc_ref.get()
-        if existing_doc.exists:
-            existing_docs = existing_doc.to_dict().get('documents', [])
-        else:
-            existing_docs = []
-        
-        # Add new documents
-        existing_docs.extend(documents)
-        
-        # Save back to Firestore
-        user_doc_ref.set({
-            'documents': existing_docs,
-            'updated_at': datetime.now()
-        })
+        for document_data in documents:
+            save_user_document(user_id, document_data)
         logger.info(f"Documents saved for user {user_id}")
     except Exception as e:
-        logger.error(f"Error saving documents to Firestore for user {user_id}: {e}")
+        logger.error(f"Error saving documents for user {user_id}: {e}")
+
+def is_processing(document: Dict) -> bool:
+    # Whichever worker runs the upload job only invalidates its own cache, so these are never cached
+    return document.get('status') == 'processing'
+
+def ensure_document_ready(document: Dict) -> None:
+    """409 for a document still processing or whose processing failed; clients poll /api/jobs/{job_id}"""
+    status = document.get('status', 'ready')
+    if status == 'ready':
+        return
+    raise HTTPException(status_code=409, detail={
+        "message": "Document is still being processed." if status == 'processing' else "Document processing failed.",
+        "status": status,
+        "job_id": document.get('job_id'),
+        "processing_error": document.get('processing_error')
+    })
+
+def get_user_documents(user_id: str, include_content: bool = False) -> List[Dict]:
+    """Get user documents; text and chunks are only loaded when asked for"""
+    cache_key = ('documents', user_id, include_content)
+    documents = document_cache.get(cache_key)
+    if documents is None:
+        try:
+            documents = storage.get_documents(user_id, include_content=include_content)
+        except Exception as e:
+            logger.error(f"Error getting documents for user {user_id}: {e}")
+            return []
+        if not any(is_processing(document) for document in documents):
+            document_cache.set(cache_key, documents)
+    # Shallow copies, so callers that fill in fields don't change what other requests read from the cache
+    return [dict(document) for document in documents]
+
+def get_user_document(user_id: str, document_id: str, include_content: bool = True) -> Optional[Dict]:
+    """Get a single user document"""
+    cache_key = ('document', user_id, document_id, include_content)
+    document = document_cache.get(cache_key)
+    if document is None:
+        try:
+            document = storage.get_document(user_id, document_id, include_content=include_content)
+        except Exception as e:
+            logger.error(f"Error getting document {document_id} for user {user_id}: {e}")
+            return None
+        if document is not None and not is_processing(document):
+            document_cache.set(cache_key, document)
+    return dict(document) if document is not None else None
+
+def get_document_content(user_id: str, metadata: Dict) -> Dict:
+    """Load text and chunks for an already-fetched metadata record"""
+    cache_key = ('document', user_id, metadata['id'], True)
+    document = document_cache.get(cache_key)
+    if document is None:
+        document = storage.get_document_content(user_id, metadata)
+        if not is_processing(document):
+            document_cache.set(cache_key, document)
+    return dict(document)
+
+def update_user_document(user_id: str, document_id: str, fields: Dict) -> None:
+    """Update stored document metadata and the cached reads that include it"""
+    storage.update_document(user_id, document_id, fields)
+    invalidate_user_documents(user_id, document_id)
+
+def get_documents_for_retrieval(user_id: str) -> List[Dict]:
+    """Document metadata, with content loaded only for documents the retrieval indexes have not seen"""
+    documents = get_user_documents(user_id)
+    index = index_registry.get(user_id)
+    for i, doc in enumerate(documents):
+        if not doc.get('total_chunks'):
+            continue
+        needs_content = not index.has_document(doc['id'])
+        if RETRIEVAL_MODE != "lexical" and not vector_registry.get(user_id).has_document(doc['id']):
+            needs_content = True
+        if needs_content:
+            documents[i] = get_document_content(user_id, doc)
+    return documents
+
+
+async def process_upload_job(job: Dict) -> Dict:
+    """Extract, chunk, save and index an uploaded file; runs on the job queue"""
+    user_id = job['user_id']
+    document_data = await run_blocking(get_user_document, user_id, job['document_id'], include_content=False)
+    if document_data is None:
+        logger.info(f"Document {job['document_id']} was deleted before processing")
+        return {'skipped': True}
+
+    file_type = document_data.get('file_type', '')
+    content_hash = document_data.get('content_hash')
+    if document_data.get('file_size') == 0:
+        raise PermanentJobError("Uploaded file is empty")
+
+    # Identical files (same content hash) share their extraction, chunks and embeddings
+    extraction = await run_blocking(artifact_store.load_json, content_hash, "extraction") if content_hash else None
+    if extraction is None:
+        extraction = {'text': "", 'pages': None, 'page_count': None}
+        try:
+            if file_type == "application/pdf":
+                with time_stage("pdf_extraction"):
+                    extraction = await extract_pdf(document_data['file_path'])
+            elif file_type.startswith("text/"):
+                with time_stage("text_extraction"):
+                    extraction['text'] = await run_blocking(read_text_upload, document_data['file_path'])
+        except (UnreadablePdfError, UnicodeDecodeError) as e:
+            # The same bytes will fail the same way on every attempt
+            raise PermanentJobError(str(e)) from e
+        if content_hash:
+            await run_blocking(artifact_store.save_json, content_hash, "extraction", extraction)
+    else:
+        logger.info(f"Reusing extracted text of identical content {content_hash[:12]} for {document_data['id']}")
+
+    extracted_text, pages = extraction['text'], extraction.get('pages')
+    if pages:
+        document_data['page_count'] = extraction['page_count']
+        document_data['pages'] = pages
+
+    # Identical text (from any user) shares one summary
+    document_data['text_hash'] = await run_blocking(text_hash, extracted_text)
+    shared_summary = await run_blocking(storage.get_summary, summary_key(document_data['text_hash'])) if extracted_text else None
+    if shared_summary:
+        document_data['summary'] = shared_summary.get('summary', '')
+        document_data['key_points'] = shared_summary.get('key_points', [])
+        document_data['summary_text_hash'] = document_data['text_hash']
+
+    document_data = {
+        **document_data,
+        "extracted_text": extracted_text,
+        "status": "ready",
+        "job_id": job['id'],
+        "processed_at": datetime.now().isoformat()
+    }
+    if extracted_text:
+        chunks = await run_blocking(build_document_chunks, content_hash, extracted_text, document_data['original_name'], pages)
+        document_data['chunks'] = chunks
+        document_data['total_chunks'] = len(chunks)
 
-def get_user_documents(user_id: str) -> List[Dict]:
-    """Get user documents from Firestore"""
+    # The user may have deleted the document while it was being processed; don't bring it back
+    if not await run_blocking(save_user_document, user_id, document_data, True):
+        logger.info(f"Document {document_data['id']} was deleted during processing")
+        return {'skipped': True}
+    with time_stage("indexing"):
+        await run_blocking(index_user_document, user_id, document_data)
+    if await run_blocking(storage.get_document, user_id, document_data['id'], False) is None:
+        # Deleted between the save and the indexing: the delete's unindex may have run first
+        await run_blocking(unindex_user_document, user_id, document_data['id'])
+        return {'skipped': True}
+
+    if PRESUMMARIZE_UPLOADS and extracted_text and not shared_summary:
+        summary_result = await app.state.process_factory.generate_summary_and_key_points(
+            extracted_text,
+            chunks=document_data.get('chunks')
+        )
+        if summary_result['success']:
+            await run_blocking(save_document_summary, user_id, document_data, summary_result)
+        else:
+            logger.warning(f"Pre-summarization failed for {document_data['id']}: {summary_result.get('message')}")
+
+    return {'total_chunks': document_data.get('total_chunks', 0), 'has_text': bool(extracted_text)}
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def summary_key(document_text_hash: str) -> str:
+    """Storage key of the summary shared by every document with this text"""
+    return f"document:{SUMMARY_PROMPT_VERSION}:{document_text_hash}"
+
+def save_document_summary(user_id: str, document_data: Dict, summary_result: Dict) -> None:
+    """Store a generated summary on the document, and by text hash for every document with the same text"""
+    summary = {
+        'summary': summary_result.get('summary', ''),
+        'key_points': summary_result.get('key_points', [])
+    }
+    update_user_document(user_id, document_data['id'], {
+        **summary,
+        'text_hash': document_data['text_hash'],
+        'summary_text_hash': document_data['text_hash']
+    })
+    storage.save_summary(summary_key(document_data['text_hash']), summary)
+
+async def upload_job_failed(job: Dict, error: str) -> None:
+    """Mark the document as failed once its processing job has run out of retries"""
     try:
-        user_doc_ref = db.collection('user_documents').document(user_id)
-        doc = user_doc_ref.get()
-        
-        if doc.exists:
-            return doc.to_dict().get('documents', [])
-        return []
-    except Exception as e:
-        logger.error(f"Error getting documents from Firestore for user {user_id}: {e}")
-        return []
+        await run_blocking(update_user_document, job['user_id'], job['document_id'], {
+            'status': 'failed',
+            'processing_error': error
+        })
+    except KeyError:
+        pass  # Document was deleted meanwhile (every storage backend raises KeyError for a missing one)
 
+job_queue.register("process_upload", process_upload_job, on_failure=upload_job_failed)
 
 @app.post("/api/upload")
 async def upload_files(files: List[UploadFile] = File(...), user = Depends(verify_token)):
-    """Upload and process files"""
+    """Store uploaded files and queue their processing; poll /api/jobs/{job_id} for progress"""
     try:
         user_id = user['uid']
         uploaded_files_info = []
-        documents_to_save = []
         
         for file in files:
             logger.info(f"Processing uploaded file: {file.filename} ({file.content_type})")
@@ -198,56 +481,51 @@ async def upload_files(files: List[UploadFile] = File(...), user = Depends(verif
                 logger.warning(f"Skipping file {file.filename} due to missing content type.")
                 continue
                 
-            file_content = await file.read()
-            file_extension = os.path.splitext(file.filename)[1]
             unique_filename = f"{user_id}_{datetime.now().timestamp()}_{file.filename}"
             file_path = os.path.join(UPLOAD_DIR, unique_filename)
             
-            with open(file_path, "wb") as buffer:
-                buffer.write(file_content)
-            logger.info(f"File saved to: {file_path}")
+            # Stream into the content-addressed blob store, then link the blob to this upload's own path
+            temp_path = artifact_store.temp_path()
+            with time_stage("upload_write"):
+                stored = await stream_upload(file, temp_path)
+            is_new_content = await run_blocking(artifact_store.store_blob, temp_path, stored['sha256'])
+            await run_blocking(artifact_store.link_blob, stored['sha256'], file_path)
+            logger.info(f"File saved to: {file_path} ({stored['size']} bytes{'' if is_new_content else ', same content as an earlier upload'})")
+            # Blobs are shared by all users, so only this user's own uploads say whether it is a duplicate
+            existing_documents = await run_blocking(get_user_documents, user_id)
+            duplicate = any(doc.get('content_hash') == stored['sha256'] for doc in existing_documents)
             
-            extracted_text = ""
-            if file.content_type == "application/pdf":
-                extracted_text = extract_text_from_pdf(file_content)
-            elif file.content_type.startswith("text/"):
-                extracted_text = file_content.decode('utf-8')
-            
-            # Create document_data dictionary FIRST
+            # Save the metadata record now so the document is listed while it is processed
             document_data = {
                 "id": unique_filename,
                 "original_name": file.filename,
                 "file_type": file.content_type,
-                "file_size": len(file_content),
+                "file_size": stored['size'],
+                "content_hash": stored['sha256'],
                 "file_path": file_path,
-                "extracted_text": extracted_text,
+                "status": "processing",
                 "uploaded_at": datetime.now().isoformat()
             }
-            
-            # THEN add chunking if extracted_text exists
-            if extracted_text:
-                chunks = chunk_document_with_metadata(extracted_text, file.filename)
-                document_data['chunks'] = chunks
-                document_data['total_chunks'] = len(chunks)
-            
-            documents_to_save.append(document_data)
+            await run_blocking(save_user_document, user_id, document_data)
+            job = await job_queue.enqueue("process_upload", user_id, {"file_path": file_path}, document_id=unique_filename)
+            await run_blocking(update_user_document, user_id, unique_filename, {'job_id': job['id']})
             
             # Fix: Include full URL with backend domain
             uploaded_files_info.append({
                 "name": file.filename,
-                "size": len(file_content),
+                "size": stored['size'],
                 "type": file.content_type,
                 "id": unique_filename,
-                "url": f"{BASE_URL}/static/{unique_filename}"  # Full URL instead of relative
+                "url": f"{BASE_URL}/static/{unique_filename}",  # Full URL instead of relative
+                "job_id": job['id'],
+                "status": "processing",
+                "duplicate": duplicate
             })
         
-        if documents_to_save:
-            save_user_documents(user_id, documents_to_save)
-        
         return JSONResponse(
-            status_code=200,
+            status_code=202,
             content={
-                "message": "Files uploaded successfully",
+                "message": "Files uploaded, processing in background",
                 "files": uploaded_files_info,
                 "total_files": len(uploaded_files_info)
             }
@@ -256,65 +534,157 @@ async def upload_files(files: List[UploadFile] = File(...), user = Depends(verif
     except Exception as e:
         logger.error(f"Error in upload_files endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error uploading files: {str(e)}")
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str, user = Depends(verify_token)):
+    """Status of a background processing job"""
+    job = await job_queue.get(job_id)
+    if not job or job['user_id'] != user['uid']:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return JSONResponse(
+        status_code=200,
+        content={
+            "job_id": job['id'],
+            "kind": job['kind'],
+            "document_id": job['document_id'],
+            "status": job['status'],
+            "attempts": job['attempts'],
+            "result": job['result'],
+            "error": job['error'],
+            "created_at": job['created_at'],
+            "updated_at": job['updated_at']
+        }
+    )
     
+async def format_sse(events):
+    """Encode ProcessFactory stream events as Server-Sent Events"""
+    async for event in events:
+        yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+async def record_streamed_turn(events, chat_sessions: ChatSessions, user_id: str, session_id: str, question: str):
+    """Pass stream events through, saving the finished answer to the chat session before the 'done' event"""
+    async for event in events:
+        if event['event'] == 'done' and event['data'].get('success'):
+            await chat_sessions.record_turn(user_id, session_id, question, event['data']['message'])
+            event['data']['session_id'] = session_id
+        yield event
+
+@app.post("/api/sessions", status_code=201)
+async def create_session(request: SessionCreateRequest, user = Depends(verify_token), chat_sessions: ChatSessions = Depends(get_chat_sessions)):
+    """Start a server-side chat session about a document"""
+    user_id = user['uid']
+    document = await run_blocking(get_user_document, user_id, request.document_id, False)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return await chat_sessions.create(user_id, request.document_id)
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str, user = Depends(verify_token), chat_sessions: ChatSessions = Depends(get_chat_sessions)):
+    """A chat session with its rolling summary and full message history"""
+    session = await chat_sessions.get(user['uid'], session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {**session, 'messages': await chat_sessions.messages(user['uid'], session_id)}
+
+@app.delete("/api/sessions/{session_id}")
+async def delete_session(session_id: str, user = Depends(verify_token), chat_sessions: ChatSessions = Depends(get_chat_sessions)):
+    if not await chat_sessions.delete(user['uid'], session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"success": True, "message": "Session deleted successfully"}
+
 @app.post("/api/process-command")
-async def process_command(message: MessageRequest, user = Depends(verify_token)):
+async def process_command(message: MessageRequest, user = Depends(verify_token), processor_factory: ProcessFactory = Depends(get_process_factory), chat_sessions: ChatSessions = Depends(get_chat_sessions)):
     """Process natural language commands using AI"""
     try:
         user_id = user['uid']
         logger.info(f"Processing command for user: {user_id}")
 
         # Get user documents for context
-        user_documents = get_user_documents(user_id)
+        user_documents = await run_blocking(get_documents_for_retrieval, user_id)
 
         target_document = next((doc for doc in user_documents if doc.get('id') == message.document_id), None)
 
         if not target_document:
             raise HTTPException(status_code=404, detail="Document not found for this user or ID.")
+        ensure_document_ready(target_document)
+        
+        conversation_history, conversation_summary = message.conversation_history, None
+        if message.session_id:
+            session = await chat_sessions.get(user_id, message.session_id)
+            if not session:
+                raise HTTPException(status_code=404, detail="Session not found")
+            if session['document_id'] != message.document_id:
+                raise HTTPException(status_code=400, detail="Session belongs to a different document.")
+            conversation_summary, conversation_history = await chat_sessions.prompt_history(user_id, session)
+        
+        if message.stream:
+            events = processor_factory.stream_message(
+                message.content,
+                user_id,
+                user_documents,
+                conversation_history=conversation_history,
+                top_k=message.top_k,
+                context_token_budget=message.context_token_budget,
+                conversation_summary=conversation_summary
+            )
+            if message.session_id:
+                events = record_streamed_turn(events, chat_sessions, user_id, message.session_id, message.content)
+            return StreamingResponse(
+                format_sse(events),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
         
         # Process command
-        processor_factory = ProcessFactory(db)
-        result = await processor_factory.process_message(message.content, user_id, user_documents, conversation_history=message.conversation_history)
+        result = await processor_factory.process_message(
+            message.content,
+            user_id,
+            user_documents,
+            conversation_history=conversation_history,
+            top_k=message.top_k,
+            context_token_budget=message.context_token_budget,
+            conversation_summary=conversation_summary
+        )
+        if message.session_id and result.get('success'):
+            await chat_sessions.record_turn(user_id, message.session_id, message.content, result['message'])
+            result['session_id'] = message.session_id
 
         logger.info(f"Result from process_command: {result.get('message', '')[:100]}...")
         if not result:
             raise HTTPException(status_code=400, detail="No valid command found")
         
         return result
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(f"Error in process_command endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.post("/api/generate-questions")
-async def generate_questions(request: QuestionGenerationRequest, user = Depends(verify_token)):
+async def generate_questions(request: QuestionGenerationRequest, user = Depends(verify_token), processor_factory: ProcessFactory = Depends(get_process_factory)):
     """Generate comprehension questions from a document"""
     try:
         user_id = user['uid']
         
-        # Get user documents
-        user_documents = get_user_documents(user_id)
-        
-        # Find the specific document
-        target_document = None
-        for doc in user_documents:
-            if doc.get('id') == request.document_id:
-                target_document = doc
-                break
+        # Get the specific document
+        target_document = await run_blocking(get_user_document, user_id, request.document_id)
         
         if not target_document:
             raise HTTPException(status_code=404, detail="Document not found")
+        ensure_document_ready(target_document)
         
         # Generate questions
-        processor_factory = ProcessFactory(db)
         result = await processor_factory.generate_questions_from_document(
             target_document, 
-            request.difficulty_level
+            request.difficulty_level,
+            num_questions=request.num_questions,
+            mode=request.generation_mode
         )
         
         if result['success']:
-            # Save questions to user's session (you might want to store these in DB)
-            questions_doc_ref = db.collection('user_questions').document(user_id)
-            questions_doc_ref.set({
+            # Save questions to user's session
+            await run_blocking(storage.save_questions, user_id, {
                 'questions': result['questions'],
                 'document_id': request.document_id,
                 'generated_at': datetime.now(),
@@ -323,24 +693,24 @@ async def generate_questions(request: QuestionGenerationRequest, user = Depends(
         
         return result
         
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(f"Error in generate_questions: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/evaluate-answer")
-async def evaluate_answer(request: AnswerEvaluationRequest, user = Depends(verify_token)):
+async def evaluate_answer(request: AnswerEvaluationRequest, user = Depends(verify_token), processor_factory: ProcessFactory = Depends(get_process_factory)):
     """Evaluate user's answer to a question"""
     try:
         user_id = user['uid']
         
         # Get user's questions
-        questions_doc_ref = db.collection('user_questions').document(user_id)
-        questions_doc = questions_doc_ref.get()
+        questions_data = await run_blocking(storage.get_questions, user_id)
         
-        if not questions_doc.exists:
+        if not questions_data:
             raise HTTPException(status_code=404, detail="No questions found for user")
         
-        questions_data = questions_doc.to_dict()
         questions = questions_data.get('questions', [])
         
         # Find the specific question
@@ -354,15 +724,9 @@ async def evaluate_answer(request: AnswerEvaluationRequest, user = Depends(verif
             raise HTTPException(status_code=404, detail="Question not found")
         
         # Get document data
-        user_documents = get_user_documents(user_id)
-        target_document = None
-        for doc in user_documents:
-            if doc.get('id') == request.document_id:
-                target_document = doc
-                break
+        target_document = await run_blocking(get_user_document, user_id, request.document_id)
         
         # Evaluate answer
-        processor_factory = ProcessFactory(db)
         result = await processor_factory.evaluate_answer(
             target_question,
             request.user_answer,
@@ -375,14 +739,14 @@ async def evaluate_answer(request: AnswerEvaluationRequest, user = Depends(verif
         logger.error(f"Error in evaluate_answer: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# Update the get_documents function:
 @app.get("/api/documents")
 async def get_documents(user = Depends(verify_token)):
     """Get user's uploaded documents"""
     try:
         user_id = user['uid']
-        documents = get_user_documents(user_id)
+        documents = await run_blocking(get_user_documents, user_id)
         
+        # Return only metadata (without full text content)
         doc_metadata = []
         for doc in documents:
             doc_metadata.append({
@@ -391,7 +755,9 @@ async def get_documents(user = Depends(verify_token)):
                 "file_type": doc.get("file_type"),
                 "file_size": doc.get("file_size"),
                 "uploaded_at": doc.get("uploaded_at"),
-                "has_text": bool(doc.get("extracted_text")),
+                "has_text": doc.get("has_text", False),
+                "status": doc.get("status", "ready"),
+                "job_id": doc.get("job_id"),
                 "summary": doc.get("summary", ""),
                 "keyPoints": doc.get("key_points", []),
                 "url": f"{BASE_URL}/static/{doc.get('id')}"  # Full URL
@@ -409,42 +775,61 @@ async def get_documents(user = Depends(verify_token)):
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.get("/api/summarize-document/{document_id}")
-async def summarize_document(document_id: str, user = Depends(verify_token)):
-    """Generate AI summary and key points for a specific document."""
+async def summarize_document(document_id: str, refresh: bool = False, user = Depends(verify_token), processor_factory: ProcessFactory = Depends(get_process_factory)):
+    """Summary and key points for a document: stored, shared by identical text, or generated (always with refresh=true)"""
     try:
         user_id = user['uid']
-        user_documents = get_user_documents(user_id)
-        
-        target_document = next((doc for doc in user_documents if doc.get('id') == document_id), None)
+        metadata = await run_blocking(get_user_document, user_id, document_id, include_content=False)
         
-        if not target_document:
+        if not metadata:
             raise HTTPException(status_code=404, detail="Document not found for this user.")
+        ensure_document_ready(metadata)
         
+        # The stored summary is current as long as it was made from the document's present text
+        if not refresh and metadata.get('summary') and metadata.get('text_hash') and metadata.get('summary_text_hash') == metadata['text_hash']:
+            return JSONResponse(
+                status_code=200,
+                content={"summary": metadata['summary'], "keyPoints": metadata.get('key_points', []), "cached": True}
+            )
+        
+        target_document = metadata
+        if not metadata.get('text_hash'):
+            # Documents processed before text hashes were recorded
+            target_document = await run_blocking(get_document_content, user_id, metadata)
+            if not target_document.get('extracted_text'):
+                raise HTTPException(status_code=400, detail="No extractable text found for this document.")
+            target_document = {**target_document, 'text_hash': await run_blocking(text_hash, target_document['extracted_text'])}
+        
+        if not refresh:
+            shared_summary = await run_blocking(storage.get_summary, summary_key(target_document['text_hash']))
+            if shared_summary:
+                await run_blocking(save_document_summary, user_id, target_document, shared_summary)
+                return JSONResponse(
+                    status_code=200,
+                    content={"summary": shared_summary.get('summary'), "keyPoints": shared_summary.get('key_points', []), "cached": True}
+                )
+        
+        if 'extracted_text' not in target_document:
+            target_document = {**await run_blocking(get_document_content, user_id, metadata), 'text_hash': target_document['text_hash']}
         extracted_text = target_document.get('extracted_text')
         if not extracted_text:
             raise HTTPException(status_code=400, detail="No extractable text found for this document.")
         
-        processor_factory = ProcessFactory(db)
-        summary_result = await processor_factory.generate_summary_and_key_points(extracted_text)
+        summary_result = await processor_factory.generate_summary_and_key_points(
+            extracted_text,
+            chunks=target_document.get('chunks')
+        )
         
         if summary_result['success']:
-            # Update the document in Firestore with summary and key points
-            # This is optional but good for persistence
-            updated_documents = []
-            for doc in user_documents:
-                if doc.get('id') == document_id:
-                    doc['summary'] = summary_result.get('summary', '')
-                    doc['key_points'] = summary_result.get('key_points', [])
-                updated_documents.append(doc)
-            
-            user_doc_ref = db.collection('user_documents').document(user_id)
-            user_doc_ref.set({'documents': updated_documents, 'updated_at': datetime.now()})
+            # Store on the document and under the text hash, so identical documents reuse it
+            await run_blocking(save_document_summary, user_id, target_document, summary_result)
 
             return JSONResponse(
                 status_code=200,
                 content={
                     "summary": summary_result.get('summary'),
-                    "keyPoints": summary_result.get('key_points')
+                    "keyPoints": summary_result.get('key_points'),
+                    "cached": False
                 }
             )
         else:
@@ -456,47 +841,12 @@ async def summarize_document(document_id: str, user = Depends(verify_token)):
         logger.error(f"Error in summarize_document endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating summary: {str(e)}")
 
-@app.get("/api/documents")
-async def get_documents(user = Depends(verify_token)):
-    """Get user's uploaded documents"""
-    try:
-        user_id = user['uid']
-        documents = get_user_documents(user_id)
-        
-        # Return only metadata (without full text content)
-        doc_metadata = []
-        for doc in documents:
-            doc_metadata.append({
-                "id": doc.get("id"),
-                "original_name": doc.get("original_name"),
-                "file_type": doc.get("file_type"),
-                "file_size": doc.get("file_size"),
-                "uploaded_at": doc.get("uploaded_at"),
-                "has_text": bool(doc.get("extracted_text")),
-                "summary": doc.get("summary", ""), # Include summary if present
-                "keyPoints": doc.get("key_points", []), # Include key points if present
-                "url": f"/static/{doc.get('id')}" # Provide URL for viewing
-            })
-        
-        return JSONResponse(
-            status_code=200,
-            content={
-                "documents": doc_metadata,
-                "total": len(doc_metadata)
-            }
-        )
-    except Exception as e:
-        logger.error(f"Error in get_documents endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-    
 @app.get("/api/documents/{document_id}")
 async def get_document_details(document_id: str, user = Depends(verify_token)):
     """Get details of a specific user document by its ID."""
     try:
         user_id = user['uid']
-        user_documents = get_user_documents(user_id)
-
-        target_document = next((doc for doc in user_documents if doc.get('id') == document_id), None)
+        target_document = await run_blocking(get_user_document, user_id, document_id, include_content=False)
 
         if not target_document:
             raise HTTPException(status_code=404, detail="Document not found for this user or ID.")
@@ -509,7 +859,10 @@ async def get_document_details(document_id: str, user = Depends(verify_token)):
             "pdfUrl": f"{BASE_URL}/static/{target_document.get('id')}",  # Full URL
             "summary": target_document.get("summary", None),
             "keyPoints": target_document.get("key_points", []),
-            "summaryError": target_document.get("summary_error", None)
+            "summaryError": target_document.get("summary_error", None),
+            "status": target_document.get("status", "ready"),
+            "jobId": target_document.get("job_id"),
+            "processingError": target_document.get("processing_error")
         }
 
         return JSONResponse(
@@ -529,24 +882,9 @@ async def delete_document(document_id: str, user = Depends(verify_token)):
     try:
         user_id = user['uid']
         
-        # Get user documents
-        user_doc_ref = db.collection('user_documents').document(user_id)
-        doc = user_doc_ref.get()
-        
-        if not doc.exists:
-            raise HTTPException(status_code=404, detail="No documents found")
-        
-        documents = doc.to_dict().get('documents', [])
-        
-        # Find and remove the document
-        document_to_delete = None
-        updated_documents = []
-        
-        for document in documents:
-            if document.get('id') == document_id:
-                document_to_delete = document
-            else:
-                updated_documents.append(document)
+        # Remove the document and its content records
+        document_to_delete = await run_blocking(storage.delete_document, user_id, document_id)
+        invalidate_user_documents(user_id, document_id)
         
         if not document_to_delete:
             raise HTTPException(status_code=404, detail="Document not found")
@@ -554,15 +892,13 @@ async def delete_document(document_id: str, user = Depends(verify_token)):
         # Delete file from disk
         file_path = document_to_delete.get('file_path')
         if file_path and os.path.exists(file_path):
-            os.remove(file_path)
+            await run_blocking(os.remove, file_path)
             logger.info(f"Deleted file from disk: {file_path}")
+        if document_to_delete.get('content_hash'):
+            await run_blocking(artifact_store.release_blob, document_to_delete['content_hash'])
         
-        # Update Firestore
-        user_doc_ref.set({
-            'documents': updated_documents,
-            'updated_at': datetime.now()
-        })
-        logger.info(f"Document {document_id} deleted from Firestore for user {user_id}")
+        await run_blocking(unindex_user_document, user_id, document_id)
+        logger.info(f"Document {document_id} deleted from storage for user {user_id}")
         
         return JSONResponse(
             status_code=200,
@@ -573,6 +909,20 @@ async def delete_document(document_id: str, user = Depends(verify_token)):
         logger.error(f"Error in delete_document endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/cache-stats")
+async def get_cache_stats(user = Depends(verify_token)):
+    """Hit/miss counters for the per-process document cache and the answer cache"""
+    return JSONResponse(status_code=200, content={
+        "document_cache": document_cache.stats(),
+        "answer_cache": await run_blocking(answer_cache.stats)
+    })
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: stage, request and LLM latency histograms, in-flight gauges, token counters"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,113 @@
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from services.search_index import STOPWORDS
+
+SNIPPET_MIN_SCORE = 0.5  # Below this a sentence is not considered supported by the chunk
+SNIPPET_MIN_SENTENCE_CHARS = 20
+
+WORD = re.compile(r"\w+")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+CITATION = re.compile(r"\[Reference \d+\]")
+
+
+def _words(text: str) -> List[Tuple[str, int, int]]:
+    return [(match.group().lower(), match.start(), match.end()) for match in WORD.finditer(text)]
+
+
+class ChunkShingles:
+    """Word unigram and bigram positions of one chunk, built in a single pass"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.words = _words(text)
+        self.unigrams: Dict[str, List[int]] = defaultdict(list)
+        self.bigrams: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+        for i, (word, _, _) in enumerate(self.words):
+            self.unigrams[word].append(i)
+            if i:
+                self.bigrams[(self.words[i - 1][0], word)].append(i - 1)
+
+    def align(self, sentence_words: List[str], min_score: float = SNIPPET_MIN_SCORE) -> Optional[Dict]:
+        """Score how much of a sentence the chunk contains and locate the densest matching span.
+
+        The score mixes the share of the sentence's word bigrams found in
+        the chunk (weighted 3:1) with the share of its content words, so it
+        stays high for light paraphrases without rewarding common words. The span is the window of the chunk (as long as the
+        sentence) holding the most matched positions. Returns None below
+        `min_score`.
+        """
+        content_words = [word for word in sentence_words if word not in STOPWORDS] or sentence_words
+        sentence_bigrams = list(zip(sentence_words, sentence_words[1:]))
+        if not content_words:
+            return None
+
+        matched_positions = []
+        matched_words = 0
+        for word in set(content_words):
+            positions = self.unigrams.get(word)
+            if positions:
+                matched_words += 1
+                matched_positions.extend(positions)
+
+        matched_bigrams = 0
+        for bigram in set(sentence_bigrams):
+            positions = self.bigrams.get(bigram)
+            if positions:
+                matched_bigrams += 1
+                matched_positions.extend(positions)
+                matched_positions.extend(position + 1 for position in positions)
+
+        unigram_share = matched_words / len(set(content_words))
+        bigram_share = matched_bigrams / len(set(sentence_bigrams)) if sentence_bigrams else unigram_share
+        score = 0.25 * unigram_share + 0.75 * bigram_share
+        if not matched_positions or score < min_score:
+            return None
+
+        # Two pointers over the sorted matches: the window of sentence length with the most hits
+        matched_positions.sort()
+        window = max(len(sentence_words), 1)
+        best_count, best_start, best_end = 0, matched_positions[0], matched_positions[0]
+        left = 0
+        for right, position in enumerate(matched_positions):
+            while position - matched_positions[left] >= window:
+                left += 1
+            if right - left + 1 > best_count:
+                best_count, best_start, best_end = right - left + 1, matched_positions[left], position
+
+        char_start, char_end = _sentence_bounds(self.text, self.words[best_start][1], self.words[best_end][2])
+        return {'score': score, 'char_start': char_start, 'char_end': char_end}
+
+
+def _sentence_bounds(text: str, start: int, end: int) -> Tuple[int, int]:
+    """Widen a matched span to the sentences of `text` it falls in"""
+    previous_break = max(text.rfind(". ", 0, start), text.rfind("\n", 0, start))
+    start = previous_break + 1 if previous_break != -1 else 0
+    next_break = text.find(". ", end)
+    end = next_break + 1 if next_break != -1 else len(text)
+    while start < end and text[start].isspace():
+        start += 1
+    return start, end
+
+
+def response_sentences(response: str) -> List[Tuple[str, List[str]]]:
+    """Sentences of an answer (citation markers removed) with their lower-cased words"""
+    sentences = []
+    for sentence in SENTENCE_BREAK.split(CITATION.sub("", response)):
+        sentence = sentence.strip()
+        if len(sentence) < SNIPPET_MIN_SENTENCE_CHARS:
+            continue
+        sentences.append((sentence, [word for word, _, _ in _words(sentence)]))
+    return sentences
+
+
+def best_alignment(sentences: List[Tuple[str, List[str]]], chunk_text: str) -> Optional[Dict]:
+    """Best-supported answer sentence for a chunk, with the matching snippet's offsets within the chunk"""
+    shingles = ChunkShingles(chunk_text)
+    best = None
+    for sentence, words in sentences:
+        alignment = shingles.align(words)
+        if alignment and (best is None or alignment['score'] > best['score']):
+            best = {**alignment, 'sentence': sentence}
+    return best
@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from services.cache import LRUCache, estimate_size
+
+logger = logging.getLogger(__name__)
+
+# "memory" (per process), "disk" (SQLite, shared by the workers on a host) or "none"
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory").lower()
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.db")
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?.! ")
+
+
+def answer_cache_key(question: str, context: str, model: str, temperature: float, max_tokens: int,
+                     history: List[Dict] = None, has_documents: bool = True, summary: str = None) -> str:
+    """Key for a chat answer: everything that goes into the prompt.
+
+    The document context is hashed as formatted for the prompt, reference
+    headers (file name, section, page) included since the answer cites
+    them. Users asking about identical course PDFs share entries, while a
+    renamed or edited document never hits a stale one.
+    """
+    payload = {
+        'question': normalize_question(question),
+        'context': hashlib.sha256(context.encode('utf-8')).hexdigest(),
+        'model': model,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'history': [[message.get('role'), message.get('content')] for message in (history or [])],
+        'summary': summary or '',
+        'has_documents': has_documents
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """Interface of the answer cache backends; entries are tagged with the document ids they were built from"""
+
+    def get(self, key: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Dict, tags: Iterable[str] = ()) -> None:
+        raise NotImplementedError
+
+    def invalidate_tag(self, tag: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        raise NotImplementedError
+
+
+class NullAnswerCache(AnswerCache):
+    def get(self, key: str) -> Optional[Dict]:
+        return None
+
+    def set(self, key: str, value: Dict, tags: Iterable[str] = ()) -> None:
+        pass
+
+    def invalidate_tag(self, tag: str) -> None:
+        pass
+
+    def stats(self) -> Dict:
+        return {'backend': 'none'}
+
+
+class MemoryAnswerCache(AnswerCache):
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, max_bytes: int = ANSWER_CACHE_MAX_BYTES,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS):
+        self.cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+        self.tagged: Dict[str, Set[str]] = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: Dict, tags: Iterable[str] = ()) -> None:
+        self.cache.set(key, value)
+        with self.lock:
+            for tag in tags:
+                self.tagged[tag].add(key)
+
+    def invalidate_tag(self, tag: str) -> None:
+        with self.lock:
+            keys = self.tagged.pop(tag, set())
+        for key in keys:
+            self.cache.invalidate(key)
+
+    def stats(self) -> Dict:
+        return {'backend': 'memory', **self.cache.stats()}
+
+
+DISK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed_at);
+CREATE TABLE IF NOT EXISTS answer_tags (
+    tag TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (tag, key)
+);
+"""
+
+
+class DiskAnswerCache(AnswerCache):
+    """SQLite-backed answer cache with TTL and least-recently-used eviction by entry count and bytes"""
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 max_bytes: int = ANSWER_CACHE_MAX_BYTES, ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._connection() as conn:
+            conn.executescript(DISK_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires_at FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= now:
+            self.misses += 1
+            return None
+        with conn:
+            conn.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict, tags: Iterable[str] = ()) -> None:
+        now = time.time()
+        data = json.dumps(value)
+        size = estimate_size(value)
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now + self.ttl_seconds, now)
+            )
+            conn.executemany("INSERT OR IGNORE INTO answer_tags (tag, key) VALUES (?, ?)", [(tag, key) for tag in tags])
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        removed = conn.execute("DELETE FROM answers WHERE expires_at <= ?", (now,)).rowcount
+        entries, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        while entries > self.max_entries or total_bytes > self.max_bytes:
+            row = conn.execute("SELECT key, size FROM answers ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                break
+            conn.execute("DELETE FROM answers WHERE key = ?", (row[0],))
+            entries -= 1
+            total_bytes -= row[1]
+            removed += 1
+            self.evictions += 1
+        if removed:
+            conn.execute("DELETE FROM answer_tags WHERE key NOT IN (SELECT key FROM answers)")
+
+    def invalidate_tag(self, tag: str) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM answers WHERE key IN (SELECT key FROM answer_tags WHERE tag = ?)", (tag,))
+            conn.execute("DELETE FROM answer_tags WHERE tag = ?", (tag,))
+
+    def stats(self) -> Dict:
+        entries, total_bytes = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers"
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'backend': 'disk',
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': total_bytes
+        }
+
+
+def create_answer_cache() -> AnswerCache:
+    """Build the answer cache selected by ANSWER_CACHE_BACKEND"""
+    if ANSWER_CACHE_BACKEND == "none":
+        return NullAnswerCache()
+    if ANSWER_CACHE_BACKEND == "disk":
+        return DiskAnswerCache()
+    return MemoryAnswerCache()
+
+
+answer_cache = create_answer_cache()
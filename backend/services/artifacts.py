@@ -0,0 +1,101 @@
+import os
+import json
+import uuid
+import shutil
+import logging
+from typing import Any, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "artifacts")
+
+
+class ArtifactStore:
+    """Content-addressed storage for uploaded files and the artifacts derived from them.
+
+    Blobs are stored once per SHA-256 and hardlinked to each upload's own
+    path. Derived artifacts (extracted text, chunks, embeddings)
+    are files under the same hash, so an identical upload reuses them
+    whoever uploaded it.
+    """
+
+    def __init__(self, root: str = ARTIFACT_DIR):
+        self.blob_dir = os.path.join(root, "blobs")
+        self.derived_dir = os.path.join(root, "derived")
+        self.tmp_dir = os.path.join(root, "tmp")
+        for directory in (self.blob_dir, self.derived_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def temp_path(self) -> str:
+        """Scratch path on the same filesystem as the blobs, so a finished upload can be renamed into place"""
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    def blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.blob_dir, content_hash[:2], content_hash)
+
+    def store_blob(self, temp_path: str, content_hash: str) -> bool:
+        """Move a hashed temp file into the blob store; returns False (and drops it) if the blob already existed"""
+        path = self.blob_path(content_hash)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        return True
+
+    def link_blob(self, content_hash: str, dest: str) -> None:
+        try:
+            os.link(self.blob_path(content_hash), dest)
+        except OSError:
+            # Filesystems without hardlinks (or across devices) get a copy instead
+            shutil.copyfile(self.blob_path(content_hash), dest)
+
+    def release_blob(self, content_hash: str) -> None:
+        """Drop the blob once no upload links to it any more; derived artifacts are kept for re-uploads"""
+        path = self.blob_path(content_hash)
+        try:
+            if os.stat(path).st_nlink <= 1:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _derived_path(self, content_hash: str, name: str) -> str:
+        return os.path.join(self.derived_dir, content_hash[:2], content_hash, name)
+
+    def _write_atomic(self, path: str, write) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            write(f)
+        os.replace(temp_path, path)
+
+    def load_json(self, content_hash: str, name: str) -> Optional[Any]:
+        try:
+            with open(self._derived_path(content_hash, f"{name}.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable artifact {name} for {content_hash}: {e}")
+            return None
+
+    def save_json(self, content_hash: str, name: str, data: Any) -> None:
+        payload = json.dumps(data).encode("utf-8")
+        self._write_atomic(self._derived_path(content_hash, f"{name}.json"), lambda f: f.write(payload))
+
+    def load_array(self, content_hash: str, name: str) -> Optional[np.ndarray]:
+        try:
+            return np.load(self._derived_path(content_hash, f"{name}.npy"))
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable artifact {name} for {content_hash}: {e}")
+            return None
+
+    def save_array(self, content_hash: str, name: str, array: np.ndarray) -> None:
+        self._write_atomic(self._derived_path(content_hash, f"{name}.npy"), lambda f: np.save(f, array))
+
+
+artifact_store = ArtifactStore()
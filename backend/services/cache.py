@@ -0,0 +1,93 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate in-memory size of JSON-like data, dominated by its strings"""
+    if isinstance(value, str):
+        return len(value) + 49
+    if isinstance(value, dict):
+        return 64 + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry TTL and an approximate byte budget"""
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 256 * 1024 * 1024, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, size, expires_at)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, size: int = None, ttl: float = None) -> None:
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes:
+            return  # Never worth evicting everything else for one entry
+
+        expires_at = time.monotonic() + (self.ttl_seconds if ttl is None else ttl)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, expires_at)
+            self.total_bytes += size
+
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes
+            }
@@ -0,0 +1,120 @@
+import os
+import re
+import bisect
+from typing import Dict, Iterator, List, Tuple
+
+from services.tokens import CHARS_PER_TOKEN, estimate_tokens
+
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "300"))
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "500"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+
+# Part of the cache key for chunks derived from identical content; bump when the algorithm changes
+CHUNKER_VERSION = f"tokens-v1-{CHUNK_TARGET_TOKENS}-{CHUNK_MAX_TOKENS}-{CHUNK_OVERLAP_TOKENS}"
+
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+
+Span = Tuple[int, int]
+
+
+def _trimmed(text: str, start: int, end: int) -> Iterator[Span]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start < end:
+        yield start, end
+
+
+def _split(text: str, pattern: re.Pattern, start: int, end: int) -> Iterator[Span]:
+    """Non-blank spans of text[start:end] between matches of `pattern`"""
+    position = start
+    for match in pattern.finditer(text, start, end):
+        yield from _trimmed(text, position, match.start())
+        position = match.end()
+    yield from _trimmed(text, position, end)
+
+
+def _hard_split(text: str, start: int, end: int, max_chars: int) -> Iterator[Span]:
+    """Cut an over-long span at the last whitespace before max_chars (or at max_chars if there is none)"""
+    while end - start > max_chars:
+        cut = text.rfind(" ", start + 1, start + max_chars)
+        if cut == -1:
+            cut = start + max_chars
+        yield from _trimmed(text, start, cut)
+        start = cut
+    yield from _trimmed(text, start, end)
+
+
+def _units(text: str, max_chars: int) -> Iterator[Span]:
+    """Paragraphs, falling back to sentences and then word boundaries for anything over max_chars"""
+    for paragraph_start, paragraph_end in _split(text, PARAGRAPH_BREAK, 0, len(text)):
+        if paragraph_end - paragraph_start <= max_chars:
+            yield paragraph_start, paragraph_end
+            continue
+        for sentence_start, sentence_end in _split(text, SENTENCE_BREAK, paragraph_start, paragraph_end):
+            if sentence_end - sentence_start <= max_chars:
+                yield sentence_start, sentence_end
+            else:
+                yield from _hard_split(text, sentence_start, sentence_end, max_chars)
+
+
+def chunk_spans(text: str, target_tokens: int = CHUNK_TARGET_TOKENS, max_tokens: int = CHUNK_MAX_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[Span]:
+    """(char_start, char_end) of each chunk, in one pass over the text.
+
+    Units (paragraphs, or smaller pieces of long paragraphs) are packed
+    into a chunk until the next one would take it past the target size;
+    no chunk exceeds the max size. Each chunk starts with the trailing
+    units of the previous one, up to the overlap size.
+    """
+    target_chars = target_tokens * CHARS_PER_TOKEN
+    max_chars = max(max_tokens, target_tokens) * CHARS_PER_TOKEN
+    overlap_chars = overlap_tokens * CHARS_PER_TOKEN
+
+    spans = []
+    window: List[Span] = []
+    for unit_start, unit_end in _units(text, max_chars):
+        if window and unit_end - window[0][0] > target_chars:
+            spans.append((window[0][0], window[-1][1]))
+
+            # Carry the tail of this chunk into the next one, never the whole chunk
+            tail_start = len(window)
+            while tail_start > 1 and window[-1][1] - window[tail_start - 1][0] <= overlap_chars:
+                tail_start -= 1
+            window = window[tail_start:]
+            if window and unit_end - window[0][0] > max_chars:
+                window = []
+        window.append((unit_start, unit_end))
+
+    if window:
+        spans.append((window[0][0], window[-1][1]))
+    return spans
+
+
+def chunk_document(text: str, filename: str, pages: List[Dict] = None) -> List[Dict]:
+    """Token-sized chunks with character offsets, plus page numbers when `pages` (from PDF extraction) is given"""
+    page_starts = [page['char_start'] for page in pages] if pages else None
+
+    chunks = []
+    for i, (char_start, char_end) in enumerate(chunk_spans(text)):
+        chunk_text = text[char_start:char_end]
+        chunk = {
+            'text': chunk_text,
+            'paragraph_index': i,
+            'section': f"Paragraph {i+1}",
+            'document': filename,
+            'char_start': char_start,
+            'char_end': char_end,
+            'token_count': estimate_tokens(chunk_text)
+        }
+        if page_starts:
+            first_page = pages[max(0, bisect.bisect_right(page_starts, char_start) - 1)]['page']
+            last_page = pages[max(0, bisect.bisect_right(page_starts, char_end - 1) - 1)]['page']
+            chunk['page'] = first_page
+            if last_page != first_page:
+                chunk['page_end'] = last_page
+        chunks.append(chunk)
+
+    return chunks
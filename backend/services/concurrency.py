@@ -0,0 +1,26 @@
+import os
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Threads for blocking I/O (Firestore, Firebase auth, disk). 0 runs calls inline on the event loop.
+BLOCKING_IO_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", "32"))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io") if BLOCKING_IO_WORKERS > 0 else None
+
+
+async def run_blocking(func: Callable, *args, **kwargs):
+    """Run a synchronous call on the bounded I/O pool so it doesn't stall the event loop"""
+    if _executor is None:
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor() -> None:
+    if _executor is not None:
+        _executor.shutdown(wait=True)
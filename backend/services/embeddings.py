@@ -0,0 +1,75 @@
+import os
+import hashlib
+import logging
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from services.search_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class Embedder:
+    """Base class for text embedders. Implementations return L2-normalized float32 rows."""
+
+    name = "base"
+    dimension = 0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic offline embedder using signed feature hashing of unigrams and bigrams"""
+
+    name = "hashing"
+
+    def __init__(self, dimension: int = 512):
+        self.dimension = dimension
+
+    def _bucket(self, feature: str):
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        sign = 1.0 if value & 1 else -1.0
+        return (value >> 1) % self.dimension, sign
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features: Dict[str, int] = {}
+            for token in tokens:
+                features[token] = features.get(token, 0) + 1
+            for first, second in zip(tokens, tokens[1:]):
+                bigram = f"{first} {second}"
+                features[bigram] = features.get(bigram, 0) + 1
+
+            for feature, count in features.items():
+                bucket, sign = self._bucket(feature)
+                matrix[row, bucket] += sign * (1.0 + np.log(count))
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+EMBEDDERS: Dict[str, Callable[[], Embedder]] = {
+    'hashing': lambda: HashingEmbedder(int(os.getenv("HASHING_EMBEDDER_DIM", "512"))),
+}
+
+
+def register_embedder(name: str, factory: Callable[[], Embedder]) -> None:
+    """Make an embedder selectable through the EMBEDDER environment variable"""
+    EMBEDDERS[name] = factory
+
+
+def get_embedder(name: str = None) -> Embedder:
+    """Instantiate the configured embedder, falling back to the hashing embedder"""
+    name = (name or os.getenv("EMBEDDER", "hashing")).lower()
+    factory = EMBEDDERS.get(name)
+    if factory is None:
+        logger.warning(f"Unknown embedder '{name}', falling back to hashing embedder")
+        factory = EMBEDDERS['hashing']
+    return factory()
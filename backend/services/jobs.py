@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from services.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Jobs read files from the local uploads directory, so the job table lives on local disk next to them
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+# A running job whose lease is not renewed (worker crashed or restarted) is picked up again
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    document_id TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_expires_at REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+COLUMNS = ('id', 'kind', 'user_id', 'document_id', 'payload', 'status', 'attempts', 'result', 'error', 'created_at', 'updated_at')
+
+
+class JobStore:
+    """Persistent job table in a local SQLite file, shared by every worker process on the host"""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self.local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _to_job(self, row) -> Dict:
+        job = dict(zip(COLUMNS, row))
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def enqueue(self, kind: str, user_id: str, payload: Dict, document_id: str = None) -> Dict:
+        now = datetime.now().isoformat()
+        job_id = uuid.uuid4().hex
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, user_id, document_id, payload, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, user_id, document_id, json.dumps(payload), QUEUED, now, now)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self._connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return self._to_job(row) if row else None
+
+    def claim_next(self) -> Optional[Dict]:
+        """Atomically take the oldest queued job (or one whose lease ran out) and mark it running"""
+        conn = self._connection()
+        while True:
+            now = time.time()
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_expires_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now)
+            ).fetchone()
+            if row is None:
+                return None
+
+            with conn:
+                # Another process may claim the same row between the SELECT and here; only one UPDATE wins
+                claimed = conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_expires_at = ?, updated_at = ? "
+                    "WHERE id = ? AND (status = ? OR (status = ? AND lease_expires_at < ?))",
+                    (RUNNING, now + JOB_LEASE_SECONDS, datetime.now().isoformat(), row[0], QUEUED, RUNNING, now)
+                ).rowcount
+            if claimed:
+                return self.get(row[0])
+
+    def renew_lease(self, job_id: str) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = ?",
+                (time.time() + JOB_LEASE_SECONDS, job_id, RUNNING)
+            )
+
+    def complete(self, job_id: str, result: Optional[Dict] = None) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (DONE, json.dumps(result) if result is not None else None, datetime.now().isoformat(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str, retry: bool) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_expires_at = 0, updated_at = ? WHERE id = ?",
+                (QUEUED if retry else FAILED, error, datetime.now().isoformat(), job_id)
+            )
+
+    def release(self, job_id: str) -> None:
+        """Hand a running job back to the queue without counting the attempt"""
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts - 1, lease_expires_at = 0, updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (QUEUED, datetime.now().isoformat(), job_id, RUNNING)
+            )
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help (e.g. an unreadable upload); the job fails right away"""
+
+
+JobHandler = Callable[[Dict], Awaitable[Optional[Dict]]]
+
+
+class JobQueue:
+    """Runs jobs from a JobStore on a fixed number of asyncio workers.
+
+    Handlers are coroutines; they should push blocking work through
+    run_blocking. A failing job is retried up to JOB_MAX_ATTEMPTS times
+    (not at all for PermanentJobError), after which its `on_failure`
+    callback runs.
+    """
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS):
+        self.store = store
+        self.workers = workers
+        self.handlers: Dict[str, JobHandler] = {}
+        self.failure_handlers: Dict[str, Callable[[Dict, str], Awaitable[None]]] = {}
+        self.tasks: List[asyncio.Task] = []
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def register(self, kind: str, handler: JobHandler, on_failure: Callable[[Dict, str], Awaitable[None]] = None) -> None:
+        self.handlers[kind] = handler
+        if on_failure:
+            self.failure_handlers[kind] = on_failure
+
+    async def enqueue(self, kind: str, user_id: str, payload: Dict, document_id: str = None) -> Dict:
+        job = await run_blocking(self.store.enqueue, kind, user_id, payload, document_id)
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        return await run_blocking(self.store.get, job_id)
+
+    def start(self) -> None:
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info(f"Started {self.workers} job workers")
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            try:
+                job = await run_blocking(self.store.claim_next)
+            except Exception as e:
+                logger.error(f"Job worker {n} could not claim a job: {e}")
+                job = None
+
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _keep_lease(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            await run_blocking(self.store.renew_lease, job_id)
+
+    async def _run(self, job: Dict) -> None:
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            await run_blocking(self.store.fail, job['id'], f"No handler for job kind {job['kind']}", False)
+            return
+
+        lease = asyncio.create_task(self._keep_lease(job['id']))
+        try:
+            result = await handler(job)
+        except asyncio.CancelledError:
+            # Shutting down: put the job back so the next start picks it up immediately
+            self.store.release(job['id'])
+            raise
+        except Exception as e:
+            permanent = isinstance(e, PermanentJobError)
+            error = str(e) if permanent else f"{type(e).__name__}: {e}"
+            retry = not permanent and job['attempts'] < JOB_MAX_ATTEMPTS
+            logger.error(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}: {error}")
+            await run_blocking(self.store.fail, job['id'], error, retry)
+            if not retry and job['kind'] in self.failure_handlers:
+                try:
+                    await self.failure_handlers[job['kind']](job, error)
+                except Exception as callback_error:
+                    logger.error(f"Failure callback for job {job['id']} raised: {callback_error}")
+        else:
+            await run_blocking(self.store.complete, job['id'], result)
+            logger.info(f"Job {job['id']} ({job['kind']}) done")
+        finally:
+            lease.cancel()
@@ -0,0 +1,135 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans a cached storage read up to a long map-reduce summary
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_SECONDS = Histogram(
+    "navarya_stage_seconds", "Time spent in one processing stage (storage, retrieval, extraction, ...)",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "navarya_request_seconds", "HTTP request time until the last body byte was sent",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "navarya_requests_in_flight", "HTTP requests being served",
+    ["method", "route"], multiprocess_mode="livesum"
+)
+LLM_SECONDS = Histogram(
+    "navarya_llm_seconds", "LLM call time until the complete response",
+    ["operation"], buckets=LATENCY_BUCKETS
+)
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "navarya_llm_first_token_seconds", "Time until the first token of a streamed LLM response",
+    ["operation"], buckets=LATENCY_BUCKETS
+)
+LLM_CALLS_IN_FLIGHT = Gauge(
+    "navarya_llm_calls_in_flight", "LLM calls waiting for a response",
+    ["operation"], multiprocess_mode="livesum"
+)
+LLM_TOKENS = Counter(
+    "navarya_llm_tokens", "LLM tokens as reported in response usage",
+    ["operation", "type"]
+)
+
+
+@contextmanager
+def time_stage(stage: str):
+    """Observe the time spent in the block under navarya_stage_seconds{stage=...}"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def record_llm_usage(operation: str, usage) -> None:
+    """Count the prompt and completion tokens of an OpenAI-style `usage` object"""
+    if usage is None:
+        return
+    LLM_TOKENS.labels(operation, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    LLM_TOKENS.labels(operation, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+class InstrumentedStorage:
+    """StorageBackend wrapper timing every call as stage "storage.<method>" """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __getattr__(self, name):
+        attribute = getattr(self.storage, name)
+        if not callable(attribute):
+            return attribute
+
+        stage = f"storage.{name}"
+
+        def timed(*args, **kwargs):
+            with time_stage(stage):
+                return attribute(*args, **kwargs)
+        return timed
+
+
+def _route_path(scope) -> str:
+    """Route template for a request (e.g. /api/documents/{document_id}), keeping label cardinality bounded"""
+    app = scope.get("app")
+    for route in getattr(app, "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "other")
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording in-flight requests and latency per route.
+
+    Pure ASGI rather than BaseHTTPMiddleware so streamed (SSE) responses are
+    counted until their last chunk instead of until their headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = _route_path(scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            REQUEST_SECONDS.labels(method, route, str(status)).observe(time.perf_counter() - started)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Prometheus text exposition; aggregates all workers when PROMETHEUS_MULTIPROC_DIR is set"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,95 @@
+import os
+import mmap
+import asyncio
+import logging
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import PyPDF2
+
+logger = logging.getLogger(__name__)
+
+# PDF parsing is CPU-bound, so it runs in worker processes rather than the I/O thread pool
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class UnreadablePdfError(ValueError):
+    """The file is not a PDF PyPDF2 can parse"""
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawn, not fork: forking a server with busy threads can copy held locks (SQLite, logging) into the child
+        _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACTION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pdf_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+@contextmanager
+def open_pdf(path: str):
+    """PdfReader over a memory-mapped file; given a path, PyPDF2 would copy the whole file into memory"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield PyPDF2.PdfReader(mapped)
+
+
+def count_pages(path: str) -> int:
+    with open_pdf(path) as reader:
+        return len(reader.pages)
+
+
+def extract_page_range(path: str, start: int, end: int) -> List[str]:
+    """Text of pages [start, end); runs in a worker process, which maps the file itself"""
+    with open_pdf(path) as reader:
+        return [(reader.pages[i].extract_text() or "").strip() for i in range(start, end)]
+
+
+def join_pages(page_texts: List[str]) -> Tuple[str, List[Dict]]:
+    """Join page texts in one pass and record where each page lands in the joined text"""
+    parts = []
+    pages = []
+    offset = 0
+    for page_number, page_text in enumerate(page_texts, start=1):
+        if not page_text:
+            continue
+        if parts:
+            offset += 1  # The "\n" separator
+        pages.append({'page': page_number, 'char_start': offset, 'char_end': offset + len(page_text)})
+        parts.append(page_text)
+        offset += len(page_text)
+    return "\n".join(parts), pages
+
+
+async def extract_pdf(path: str) -> Dict:
+    """Extract a PDF's text in the process pool, spreading large files across workers by page range.
+
+    Returns the joined text and a `pages` list of {'page', 'char_start',
+    'char_end'} entries (1-based page numbers; empty pages are skipped).
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+
+    try:
+        page_count = await loop.run_in_executor(pool, count_pages, path)
+        ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count)) for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+        results = await asyncio.gather(
+            *(loop.run_in_executor(pool, extract_page_range, path, start, end) for start, end in ranges)
+        )
+    except PyPDF2.errors.PdfReadError as e:
+        raise UnreadablePdfError(f"Could not read PDF: {e}") from e
+
+    page_texts = [page_text for result in results for page_text in result]
+    text, pages = join_pages(page_texts)
+    logger.info(f"Extracted {len(text)} characters from {page_count} pages of {path} in {len(ranges)} tasks")
+    return {'text': text, 'pages': pages, 'page_count': page_count}
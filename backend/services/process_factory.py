@@ -1,12 +1,25 @@
 import os
+import asyncio
 import logging
 from dotenv import load_dotenv
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator
 from datetime import datetime
 import difflib
-from fuzzywuzzy import fuzz
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
 import json # Import json for parsing AI response
+import hashlib
+import time
+from services.search_index import InvertedIndex, index_registry
+from services.ranking import BM25Scorer, reciprocal_rank_fusion
+from services.tokens import estimate_tokens
+from services.concurrency import run_blocking
+from services.cache import LRUCache
+from services.vector_store import vector_registry
+from services.alignment import best_alignment, response_sentences
+from services.answer_cache import answer_cache, answer_cache_key
+from services.sessions import SESSION_SUMMARY_MAX_TOKENS, fit_history
+from services.metrics import LLM_CALLS_IN_FLIGHT, LLM_FIRST_TOKEN_SECONDS, LLM_SECONDS, record_llm_usage, time_stage
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -15,70 +28,220 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# BM25 score at which a reference counts as half-confident
+CONFIDENCE_SCORE_PIVOT = 4.0
+
+# "lexical" ranks chunks with BM25, "vector" with embedding similarity, "hybrid" fuses both
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+
+# Chat completion settings for document Q&A
+CHAT_MODEL = "deepseek-chat"
+CHAT_TEMPERATURE = 0.3  # Lower for more factual responses
+CHAT_MAX_TOKENS = 2000
+
+# Per-deployment context size defaults; requests may override them
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+MAX_RETRIEVAL_TOP_K = 50
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+CANDIDATE_DEPTH = 4  # Each ranker returns top_k * CANDIDATE_DEPTH candidates for fusion and budgeting
+
+# Question generation fan-out
+QUESTION_CONCURRENCY = int(os.getenv("QUESTION_CONCURRENCY", "5"))
+QUESTION_TIMEOUT_SECONDS = float(os.getenv("QUESTION_TIMEOUT_SECONDS", "30"))
+MAX_QUESTIONS = 20
+
+# Map-reduce summarization
+SUMMARY_DIRECT_CHARS = 30000  # Texts up to this size are summarized in a single call
+SUMMARY_GROUP_MIN_CHARS = 8000
+SUMMARY_GROUP_MAX_CHARS = 16000
+SUMMARY_BOUNDARY_MODULUS = 4  # On average a group closes every 4 units past the minimum size
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_PROMPT_VERSION = "v1"  # Bump when the summary prompts change to retire cached partial summaries
+
+# Connection pool for the shared DeepSeek client
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "60"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Keep-alive HTTP client for the LLM API, using HTTP/2 when the h2 package is installed"""
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+
+    return DefaultAsyncHttpxClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SECONDS
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=10.0)
+    )
+
+
 class ProcessFactory:
     """Factory class to create process instances based on the type of process."""
 
-    def __init__(self, db):
-        """Initialize with database instance (matching ProcessorFactory pattern)"""
+    def __init__(self, db, http_client: httpx.AsyncClient = None, storage=None):
+        """Initialize with database instance (matching ProcessorFactory pattern).
+
+        One instance is meant to live for the whole worker so every request
+        shares the client's connection pool. `storage` (a StorageBackend) is
+        used to persist partial summaries across restarts.
+        """
         self.db = db
+        self.storage = storage
+        self.partial_summaries = LRUCache(max_entries=2000, ttl_seconds=24 * 3600)
         self.DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
         if not self.DEEPSEEK_API_KEY:
             raise ValueError("DEEPSEEK_API_KEY not found in environment variables")
         
         self.client = AsyncOpenAI(
             api_key=self.DEEPSEEK_API_KEY,
-            base_url="https://api.deepseek.com"
+            base_url="https://api.deepseek.com",
+            http_client=http_client
         )
+        self.scorer = BM25Scorer()
+        self.retrieval_mode = RETRIEVAL_MODE
+        self.answer_cache = answer_cache
 
-    def _prepare_enhanced_context(self, documents: List[Dict], user_message: str, conversation_history: List[Dict] = None) -> Dict:
+    async def aclose(self) -> None:
+        """Close the LLM client and its pooled connections"""
+        await self.client.close()
+
+    async def _complete(self, operation: str, **kwargs):
+        """Non-streaming chat completion, timed and with its token usage counted under `operation`"""
+        started = time.perf_counter()
+        in_flight = LLM_CALLS_IN_FLIGHT.labels(operation)
+        in_flight.inc()
+        try:
+            response = await self.client.chat.completions.create(**kwargs)
+        finally:
+            in_flight.dec()
+            LLM_SECONDS.labels(operation).observe(time.perf_counter() - started)
+        record_llm_usage(operation, getattr(response, 'usage', None))
+        return response
+
+    def _prepare_enhanced_context(self, documents: List[Dict], user_message: str, conversation_history: List[Dict] = None, user_id: str = None, top_k: int = None, token_budget: int = None) -> Dict:
         """Enhanced context preparation with conversation history"""
         
-        # Simple keyword-based relevance (you can enhance with embeddings later)
-        relevant_chunks = []
-        user_message_lower = user_message.lower()
-        
-        for doc in documents:
-            if 'chunks' in doc:
-                for chunk in doc['chunks']:
-                    chunk_text = chunk['text'].lower()
-                    # Simple relevance scoring
-                    relevance_score = sum(1 for word in user_message_lower.split() 
-                                        if len(word) > 3 and word in chunk_text)
-                    
-                    if relevance_score > 0:
-                        relevant_chunks.append({
-                            **chunk,
-                            'relevance_score': relevance_score,
-                            'original_doc': doc['original_name']
-                        })
+        top_k = max(1, min(top_k or RETRIEVAL_TOP_K, MAX_RETRIEVAL_TOP_K))
+        token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+        candidate_depth = top_k * CANDIDATE_DEPTH
         
-        # Sort by relevance and take top chunks
-        relevant_chunks.sort(key=lambda x: x['relevance_score'], reverse=True)
-        top_chunks = relevant_chunks[:5]  # Top 5 most relevant chunks
+        # The inverted index also holds the chunk payloads that vector hits resolve to
+        if user_id:
+            index = index_registry.get(user_id)
+        else:
+            index = InvertedIndex()
+        index.sync(documents)
+        
+        if self.retrieval_mode == "vector" and user_id:
+            ranked_chunks, total_relevant_chunks = self._vector_top_k(index, documents, user_message, user_id, candidate_depth)
+        elif self.retrieval_mode == "hybrid" and user_id:
+            lexical_chunks, lexical_total = self._lexical_top_k(index, user_message, candidate_depth)
+            vector_chunks, _ = self._vector_top_k(index, documents, user_message, user_id, candidate_depth)
+            ranked_chunks = self._fuse_rankings(lexical_chunks, vector_chunks)
+            total_relevant_chunks = max(lexical_total, len(ranked_chunks))
+        else:
+            ranked_chunks, total_relevant_chunks = self._lexical_top_k(index, user_message, candidate_depth)
+        
+        # Take the best chunks that fit the token budget (the top chunk is always kept)
+        top_chunks = []
+        used_tokens = 0
+        for chunk in ranked_chunks:
+            if len(top_chunks) >= top_k:
+                break
+            chunk_tokens = estimate_tokens(chunk['text'])
+            if top_chunks and used_tokens + chunk_tokens > token_budget:
+                continue
+            top_chunks.append(chunk)
+            used_tokens += chunk_tokens
         
         # Format context with metadata
         context = ""
         chunk_references = []
         
         for i, chunk in enumerate(top_chunks):
-            context += f"\n[Reference {i+1}] From document '{chunk['original_doc']}', {chunk['section']}:\n"
+            location = f"{chunk['section']}, page {chunk['page']}" if chunk.get('page') else chunk['section']
+            context += f"\n[Reference {i+1}] From document '{chunk['original_doc']}', {location}:\n"
             context += f"{chunk['text']}\n"
             context += "-" * 50 + "\n"
             
-            chunk_references.append({
+            reference = {
                 'document': chunk['original_doc'],
                 'section': chunk['section'],
                 'paragraph_index': chunk['paragraph_index'],
-                'relevance_score': chunk['relevance_score']
-            })
+                'relevance_score': chunk['relevance_score'],
+                'retrieval': chunk['retrieval']
+            }
+            for component in ('page', 'lexical_score', 'term_coverage', 'vector_score'):
+                if component in chunk:
+                    reference[component] = chunk[component]
+            chunk_references.append(reference)
         
         return {
             'context': context,
             'references': chunk_references,
-            'total_relevant_chunks': len(relevant_chunks)
+            'total_relevant_chunks': total_relevant_chunks,
+            'context_tokens': used_tokens,
+            'chunks': top_chunks
         }
     
-    def _create_enhanced_system_prompt(self, has_documents: bool, conversation_history: List[Dict] = None) -> str:
+    def _lexical_top_k(self, index: InvertedIndex, user_message: str, k: int):
+        """Rank chunks with BM25 over the user's inverted index, using a bounded heap"""
+        top_chunks, total_candidates = self.scorer.top_k(index, user_message, k)
+        for chunk in top_chunks:
+            chunk['lexical_score'] = chunk['relevance_score']
+            chunk['retrieval'] = 'lexical'
+        return top_chunks, total_candidates
+    
+    def _vector_top_k(self, index: InvertedIndex, documents: List[Dict], user_message: str, user_id: str, k: int):
+        """Rank chunks by cosine similarity against the user's vector store"""
+        store = vector_registry.get(user_id)
+        store.sync(documents)
+        
+        query_vector = vector_registry.embedder.embed([user_message])[0]
+        hits = [(key, score) for key, score in store.search(query_vector, k) if score > 0 and key in index.chunks]
+        
+        top_chunks = [
+            {
+                **index.chunks[key],
+                'chunk_key': key,
+                'relevance_score': round(score, 4),
+                'vector_score': round(score, 4),
+                'retrieval': 'vector'
+            }
+            for key, score in hits
+        ]
+        return top_chunks, len(top_chunks)
+    
+    def _fuse_rankings(self, lexical_chunks: List[Dict], vector_chunks: List[Dict]) -> List[Dict]:
+        """Reciprocal-rank fusion of the lexical and vector rankings"""
+        lexical_by_key = {chunk['chunk_key']: chunk for chunk in lexical_chunks}
+        vector_by_key = {chunk['chunk_key']: chunk for chunk in vector_chunks}
+        
+        fused = reciprocal_rank_fusion(
+            [list(lexical_by_key), list(vector_by_key)],
+            k=RRF_K
+        )
+        
+        ranked_chunks = []
+        for key, score in fused:
+            # Merging keeps lexical_score/term_coverage and vector_score from whichever ranker saw the chunk
+            chunk = {**vector_by_key.get(key, {}), **lexical_by_key.get(key, {})}
+            chunk['relevance_score'] = round(score, 6)
+            chunk['retrieval'] = 'hybrid'
+            ranked_chunks.append(chunk)
+        return ranked_chunks
+    
+    def _create_enhanced_system_prompt(self, has_documents: bool, conversation_history: List[Dict] = None, has_summary: bool = False) -> str:
         """Enhanced system prompt for document Q&A"""
         
         base_prompt = """You are an intelligent document assistant. Your job is to:
@@ -92,52 +255,58 @@ class ProcessFactory:
         
         Be conversational but precise. Always justify your answers with specific references."""
         
-        if conversation_history:
+        if conversation_history or has_summary:
             base_prompt += "\n\nYou have access to our previous conversation for context, but always prioritize the document content for factual answers."
         
         return base_prompt
 
 
-    async def process_message(self, message: str, user_id: str, user_documents: List[Dict] = None, conversation_history: List[Dict] = None):
-        """Enhanced message processing with context and citations"""
-        try:
-            logger.info("Processing enhanced message with document context")
-            
-            if user_documents is None:
-                user_documents = []
-            
-            # Prepare enhanced context
-            context_data = self._prepare_enhanced_context(user_documents, message, conversation_history)
-            print("\n\n\n")
-            print(f"Context data prepared: {context_data}")  # Log first 200 chars of context
+    async def _prepare_chat(self, message: str, user_id: str, user_documents: List[Dict], conversation_history: List[Dict] = None, top_k: int = None, context_token_budget: int = None, conversation_summary: str = None):
+        """Retrieve document context and build the chat messages for a question.
 
-            
-            # Build conversation with history
-            messages = [
-                {"role": "system", "content": self._create_enhanced_system_prompt(bool(user_documents), conversation_history)}
-            ]
-            
-            # Add conversation history (last 4 messages for context)
-            if conversation_history:
-                recent_history = conversation_history[-4:]  # Last 4 messages
-                for hist_msg in recent_history:
-                    messages.append({
-                        "role": hist_msg.get("role", "user"),
-                        "content": hist_msg.get("content", "")
-                    })
-            
-            # Add document context
-            if context_data['context']:
-                messages.append({
-                    "role": "system",
-                    "content": f"Document Context:\n{context_data['context']}"
-                })
-            
-            # Add current user message
-            messages.append({"role": "user", "content": message})
-            
-            # Enhanced prompt for better citations
-            enhanced_message = f"""Question: {message}
+        `conversation_history` should already be fitted to the history token
+        budget; `conversation_summary` covers the turns before it.
+        """
+        # Prepare enhanced context
+        with time_stage("retrieval"):
+            context_data = await run_blocking(
+                self._prepare_enhanced_context,
+                user_documents, message, conversation_history,
+                user_id=user_id, top_k=top_k, token_budget=context_token_budget
+            )
+        logger.debug(
+            f"Context prepared: {len(context_data['chunks'])} chunks, {context_data['context_tokens']} tokens, "
+            f"{context_data['total_relevant_chunks']} relevant"
+        )
+
+        
+        # Build conversation with history
+        messages = [
+            {"role": "system", "content": self._create_enhanced_system_prompt(bool(user_documents), conversation_history, bool(conversation_summary))}
+        ]
+        
+        if conversation_summary:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{conversation_summary}"
+            })
+        
+        # Add the recent conversation history verbatim
+        for hist_msg in conversation_history or []:
+            messages.append({
+                "role": hist_msg.get("role", "user"),
+                "content": hist_msg.get("content", "")
+            })
+        
+        # Add document context
+        if context_data['context']:
+            messages.append({
+                "role": "system",
+                "content": f"Document Context:\n{context_data['context']}"
+            })
+        
+        # Enhanced prompt for better citations
+        enhanced_message = f"""Question: {message}
 
     Please answer this question using the provided document context. 
     Make sure to:
@@ -146,44 +315,76 @@ class ProcessFactory:
     3. If the answer isn't in the documents, say so clearly
 
     Answer:"""
+        
+        messages.append({"role": "user", "content": enhanced_message})
+        return context_data, messages
+
+    def _answer_cache_key(self, message: str, user_documents: List[Dict], conversation_history: List[Dict], context_data: Dict, conversation_summary: str = None) -> str:
+        return answer_cache_key(
+            message, context_data['context'], CHAT_MODEL, CHAT_TEMPERATURE, CHAT_MAX_TOKENS,
+            history=conversation_history,  # Already fitted, i.e. exactly the history that goes into the prompt
+            has_documents=bool(user_documents),
+            summary=conversation_summary
+        )
+
+    async def _cache_answer(self, cache_key: str, result_text: str, context_data: Dict) -> None:
+        """Remember an answer, tagged with the documents its context came from for invalidation"""
+        if not result_text:
+            return
+        document_ids = {chunk['chunk_key'][0] for chunk in context_data['chunks'] if 'chunk_key' in chunk}
+        await run_blocking(self.answer_cache.set, cache_key, {'message': result_text}, document_ids)
+
+    async def _build_chat_result(self, result_text: str, user_id: str, user_documents: List[Dict], context_data: Dict, cached: bool = False) -> Dict:
+        """Attach sources, supporting snippets and confidence to a generated answer"""
+        # Extract supporting snippets from the chunks that were sent as context (CPU-bound, so off the event loop)
+        with time_stage("snippet_extraction"):
+            supporting_snippets = await run_blocking(self.extract_supporting_snippets, result_text, context_data['chunks'])
+        
+        return {
+            'success': True,
+            'message': result_text,
+            'user_id': user_id,
+            'sources': context_data['references'],
+            'supporting_snippets': supporting_snippets,  # New field
+            'used_documents': len(user_documents) > 0,
+            'total_references': len(context_data['references']),
+            'confidence': self._calculate_confidence(context_data),
+            'cached': cached
+        }
+
+    async def process_message(self, message: str, user_id: str, user_documents: List[Dict] = None, conversation_history: List[Dict] = None, top_k: int = None, context_token_budget: int = None, conversation_summary: str = None):
+        """Enhanced message processing with context and citations"""
+        try:
+            logger.info("Processing enhanced message with document context")
             
-            messages[-1]["content"] = enhanced_message
+            if user_documents is None:
+                user_documents = []
+            # Newest turns that fit the history budget (replaces the fixed last-4-messages window)
+            conversation_history = fit_history(conversation_history or [])
+            
+            context_data, messages = await self._prepare_chat(
+                message, user_id, user_documents, conversation_history, top_k, context_token_budget, conversation_summary
+            )
+            
+            # Same question over the same retrieved chunks: reuse the answer, rebuild sources and snippets for this request
+            cache_key = self._answer_cache_key(message, user_documents, conversation_history, context_data, conversation_summary)
+            with time_stage("answer_cache_lookup"):
+                cached_answer = await run_blocking(self.answer_cache.get, cache_key)
+            if cached_answer is not None:
+                return await self._build_chat_result(cached_answer['message'], user_id, user_documents, context_data, cached=True)
             
             # Call DeepSeek
-            response = await self.client.chat.completions.create(
-                model="deepseek-chat",
+            response = await self._complete(
+                "chat",
+                model=CHAT_MODEL,
                 messages=messages,
-                temperature=0.3,  # Lower for more factual responses
-                max_tokens=2000
+                temperature=CHAT_TEMPERATURE,
+                max_tokens=CHAT_MAX_TOKENS
             )
             
             result_text = response.choices[0].message.content.strip()
-            
-             # Extract supporting snippets
-            context_chunks = []
-            if context_data['references']:
-                for ref in context_data['references']:
-                    # Find the original chunk data
-                    for doc in user_documents:
-                        if 'chunks' in doc:
-                            for chunk in doc['chunks']:
-                                if (chunk['paragraph_index'] == ref['paragraph_index'] and 
-                                    chunk['document'] == ref['document']):
-                                    context_chunks.append(chunk)
-                                    break
-            
-            supporting_snippets = self.extract_supporting_snippets(result_text, context_chunks)
-            
-            return {
-                'success': True,
-                'message': result_text,
-                'user_id': user_id,
-                'sources': context_data['references'],
-                'supporting_snippets': supporting_snippets,  # New field
-                'used_documents': len(user_documents) > 0,
-                'total_references': len(context_data['references']),
-                'confidence': self._calculate_confidence(context_data)
-            }
+            await self._cache_answer(cache_key, result_text, context_data)
+            return await self._build_chat_result(result_text, user_id, user_documents, context_data)
             
         except Exception as e:
             logger.error(f"Error in enhanced process_message: {e}")
@@ -193,75 +394,282 @@ class ProcessFactory:
                 "user_id": user_id
             }
 
+    async def stream_message(self, message: str, user_id: str, user_documents: List[Dict] = None, conversation_history: List[Dict] = None, top_k: int = None, context_token_budget: int = None, conversation_summary: str = None) -> AsyncIterator[Dict]:
+        """Streaming variant of process_message.
+
+        Yields {'event': 'token', 'data': {'content': ...}} for each piece of the
+        answer as DeepSeek produces it, then one 'done' event carrying the same
+        payload process_message returns (sources, supporting_snippets, ...).
+        Failures are reported as a final 'error' event.
+        """
+        try:
+            logger.info("Streaming enhanced message with document context")
+            
+            if user_documents is None:
+                user_documents = []
+            # Newest turns that fit the history budget (replaces the fixed last-4-messages window)
+            conversation_history = fit_history(conversation_history or [])
+            
+            context_data, messages = await self._prepare_chat(
+                message, user_id, user_documents, conversation_history, top_k, context_token_budget, conversation_summary
+            )
+            
+            cache_key = self._answer_cache_key(message, user_documents, conversation_history, context_data, conversation_summary)
+            with time_stage("answer_cache_lookup"):
+                cached_answer = await run_blocking(self.answer_cache.get, cache_key)
+            if cached_answer is not None:
+                yield {'event': 'token', 'data': {'content': cached_answer['message']}}
+                yield {'event': 'done', 'data': await self._build_chat_result(cached_answer['message'], user_id, user_documents, context_data, cached=True)}
+                return
+            
+            started = time.perf_counter()
+            in_flight = LLM_CALLS_IN_FLIGHT.labels("chat_stream")
+            in_flight.inc()
+            parts = []
+            try:
+                stream = await self.client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    temperature=CHAT_TEMPERATURE,
+                    max_tokens=CHAT_MAX_TOKENS,
+                    stream=True,
+                    stream_options={"include_usage": True}  # Usage arrives in a final chunk without choices
+                )
+                
+                async for chunk in stream:
+                    if chunk.usage:
+                        record_llm_usage("chat_stream", chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not parts:
+                            LLM_FIRST_TOKEN_SECONDS.labels("chat_stream").observe(time.perf_counter() - started)
+                        parts.append(delta)
+                        yield {'event': 'token', 'data': {'content': delta}}
+            finally:
+                in_flight.dec()
+                LLM_SECONDS.labels("chat_stream").observe(time.perf_counter() - started)
+            
+            result_text = ''.join(parts).strip()
+            await self._cache_answer(cache_key, result_text, context_data)
+            yield {'event': 'done', 'data': await self._build_chat_result(result_text, user_id, user_documents, context_data)}
+            
+        except Exception as e:
+            logger.error(f"Error in stream_message: {e}")
+            yield {
+                'event': 'error',
+                'data': {
+                    "success": False,
+                    "message": f"Sorry, I encountered an error: {str(e)}",
+                    "user_id": user_id
+                }
+            }
+
+    async def summarize_conversation(self, previous_summary: str, messages: List[Dict]) -> str:
+        """Fold chat messages into a session's rolling summary"""
+        transcript = "\n\n".join(f"{msg.get('role', 'user')}: {msg.get('content', '')}" for msg in messages)
+        prompt = f"""Update the summary of a conversation between a user and a document assistant with the new messages below.
+        Keep the questions asked, the answers and facts established (with the documents and references they came from), and anything the user said about their goals. Write at most {SESSION_SUMMARY_MAX_TOKENS * 3 // 4} words.
+
+        Current summary:
+        ---
+        {previous_summary or "(none)"}
+        ---
+
+        New messages:
+        ---
+        {transcript}
+        ---
+
+        Updated summary:"""
+
+        response = await self._complete(
+            "conversation_summary",
+            model=CHAT_MODEL,
+            messages=[
+                {"role": "system", "content": "You maintain concise, faithful summaries of conversations."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.2,
+            max_tokens=SESSION_SUMMARY_MAX_TOKENS
+        )
+        return response.choices[0].message.content.strip()
+
     def _calculate_confidence(self, context_data: Dict) -> float:
-        """Simple confidence calculation based on relevance"""
+        """Confidence from each reference's best component score: BM25 saturated and weighted by term coverage, cosine as-is"""
         if not context_data['references']:
             return 0.0
         
-        avg_relevance = sum(ref['relevance_score'] for ref in context_data['references']) / len(context_data['references'])
-        return min(avg_relevance / 10.0, 1.0)  # Normalize to 0-1
+        confidences = []
+        for ref in context_data['references']:
+            components = [0.0]
+            if 'lexical_score' in ref:
+                score = ref['lexical_score']
+                components.append(score / (score + CONFIDENCE_SCORE_PIVOT) * ref.get('term_coverage', 1.0))
+            if 'vector_score' in ref:
+                components.append(max(ref['vector_score'], 0.0))  # Cosine similarity is already 0-1
+            confidences.append(max(components))
+        return round(min(sum(confidences) / len(confidences), 1.0), 4)
 
-    async def generate_summary_and_key_points(self, document_text: str) -> Dict:
-        """Generate a summary and key points from a given document text using DeepSeek AI."""
-        try:
-            logger.info("Generating summary and key points using DeepSeek.")
+    async def _summarize_text(self, text: str, sections: bool = False) -> Dict:
+        """One summarization call; `sections` means `text` is a list of section summaries to merge"""
+        if sections:
+            prompt = f"""The following are summaries of consecutive sections of one document, in order. Combine them into a concise summary of the whole document and a list of its most important key points.
+            
+            Respond in JSON format with two keys: "summary" (string) and "keyPoints" (array of strings).
 
-            # Truncate text if it's too long for the model's context window
-            # DeepSeek-chat has a 128k context window, but for summary, we can use less.
-            # Adjust as needed based on typical document sizes and model limits.
-            if len(document_text) > 30000: # Example: limit to 30,000 characters for summary
-                document_text = document_text[:30000] + "\n... [Document truncated for summary generation] ..."
+            Section Summaries:
+            ---
+            {text}
+            ---
 
+            JSON Response:
+            """
+        else:
             prompt = f"""Please read the following document text and provide a concise summary and a list of key points.
             
             Respond in JSON format with two keys: "summary" (string) and "keyPoints" (array of strings).
 
             Document Text:
             ---
-            {document_text}
+            {text}
             ---
 
             JSON Response:
             """
 
-            messages = [
-                {"role": "system", "content": "You are an expert document summarizer. Your task is to provide accurate and concise summaries and key points from provided text."},
-                {"role": "user", "content": prompt}
-            ]
+        messages = [
+            {"role": "system", "content": "You are an expert document summarizer. Your task is to provide accurate and concise summaries and key points from provided text."},
+            {"role": "user", "content": prompt}
+        ]
 
-            response = await self.client.chat.completions.create(
-                model="deepseek-chat", # Or deepseek-coder if preferred for structured output
-                messages=messages,
-                temperature=0.3, # Lower temperature for more factual, less creative output
-                max_tokens=1000, # Sufficient tokens for summary and key points
-                response_format={"type": "json_object"} # Request JSON output
-            )
+        response = await self._complete(
+            "summary",
+            model="deepseek-chat", # Or deepseek-coder if preferred for structured output
+            messages=messages,
+            temperature=0.3, # Lower temperature for more factual, less creative output
+            max_tokens=1000, # Sufficient tokens for summary and key points
+            response_format={"type": "json_object"} # Request JSON output
+        )
 
-            result_content = response.choices[0].message.content.strip()
-            logger.info(f"DeepSeek summary response: {result_content[:200]}...")
+        result_content = response.choices[0].message.content.strip()
+        logger.info(f"DeepSeek summary response: {result_content[:200]}...")
 
-            # Parse the JSON response
-            try:
-                parsed_result = json.loads(result_content)
-                summary = parsed_result.get("summary", "No summary generated.")
-                key_points = parsed_result.get("keyPoints", [])
-                if not isinstance(key_points, list): # Ensure keyPoints is a list
-                    key_points = [str(key_points)] if key_points else []
-                
-                return {
-                    'success': True,
-                    'summary': summary,
-                    'key_points': key_points
-                }
-            except json.JSONDecodeError:
-                logger.error(f"Failed to parse JSON response from DeepSeek: {result_content}")
-                return {
-                    'success': False,
-                    'message': "AI response was not in expected JSON format.",
-                    'summary': "Could not generate summary.",
-                    'key_points': []
-                }
+        # Parse the JSON response (raises json.JSONDecodeError on malformed output)
+        parsed_result = json.loads(result_content)
+        summary = parsed_result.get("summary", "No summary generated.")
+        key_points = parsed_result.get("keyPoints", [])
+        if not isinstance(key_points, list): # Ensure keyPoints is a list
+            key_points = [str(key_points)] if key_points else []
+        return {'summary': summary, 'key_points': key_points}
+
+    def _group_for_summary(self, units: List[str]) -> List[str]:
+        """Group consecutive text units into map inputs with content-defined boundaries.
+
+        A group closes once it is past SUMMARY_GROUP_MIN_CHARS and the current
+        unit's hash hits the boundary condition (or it reaches the max size),
+        so an edit only moves the boundaries of the groups around it and the
+        other groups keep their cache keys.
+        """
+        groups = []
+        current, current_size = [], 0
+        for unit in units:
+            current.append(unit)
+            current_size += len(unit)
+            boundary = int(hashlib.sha1(unit.encode('utf-8')).hexdigest()[:8], 16) % SUMMARY_BOUNDARY_MODULUS == 0
+            if current_size >= SUMMARY_GROUP_MAX_CHARS or (current_size >= SUMMARY_GROUP_MIN_CHARS and boundary):
+                groups.append("\n\n".join(current))
+                current, current_size = [], 0
+        if current:
+            groups.append("\n\n".join(current))
+        return groups
+
+    async def _summarize_group(self, text: str, semaphore: asyncio.Semaphore, sections: bool = False) -> Dict:
+        """Summarize one group, reusing a cached partial summary for identical text"""
+        cache_key = f"partial:{SUMMARY_PROMPT_VERSION}:{'sections' if sections else 'text'}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+        cached = self.partial_summaries.get(cache_key)
+        if cached is None and self.storage is not None:
+            cached = await run_blocking(self.storage.get_summary, cache_key)
+        if cached is not None:
+            self.partial_summaries.set(cache_key, cached)
+            return {**cached, 'cached': True}
+
+        async with semaphore:
+            result = await self._summarize_text(text, sections=sections)
+
+        self.partial_summaries.set(cache_key, result)
+        if self.storage is not None:
+            await run_blocking(self.storage.save_summary, cache_key, result)
+        return {**result, 'cached': False}
+
+    async def _map_summaries(self, groups: List[str], semaphore: asyncio.Semaphore, sections: bool = False) -> List[Dict]:
+        results = await asyncio.gather(
+            *(self._summarize_group(group, semaphore, sections=sections) for group in groups),
+            return_exceptions=True
+        )
+        failed = 0
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to summarize group {i}: {type(result).__name__}: {result}")
+                failed += 1
+        if failed:
+            # A summary missing groups must not be served or shared as the document's summary. The groups
+            # that succeeded are cached, so trying again only redoes the failed ones.
+            raise ValueError(f"{failed} of {len(groups)} summary groups failed")
+        return list(results)
+
+    async def generate_summary_and_key_points(self, document_text: str, chunks: List[Dict] = None) -> Dict:
+        """Generate a summary and key points from a given document text using DeepSeek AI.
 
+        Short texts are summarized in one call. Longer ones are map-reduced:
+        groups of chunks are summarized concurrently (SUMMARY_CONCURRENCY at a
+        time), then the partial summaries are merged, in several rounds if
+        they are still too long. Partial summaries are cached by content hash,
+        so re-summarizing after a small change only redoes the affected groups.
+        If any group fails the whole summary fails rather than leaving it out.
+        """
+        try:
+            logger.info("Generating summary and key points using DeepSeek.")
+
+            if len(document_text) <= SUMMARY_DIRECT_CHARS:
+                result = await self._summarize_text(document_text)
+                return {'success': True, **result}
+
+            if chunks:
+                units = [chunk['text'] for chunk in chunks]
+            else:
+                units = [document_text[i:i + SUMMARY_GROUP_MIN_CHARS // 2] for i in range(0, len(document_text), SUMMARY_GROUP_MIN_CHARS // 2)]
+
+            semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+            groups = self._group_for_summary(units)
+            partials = await self._map_summaries(groups, semaphore)
+            cached_groups = sum(1 for partial in partials if partial['cached'])
+            logger.info(f"Summarized {len(groups)} groups ({cached_groups} from cache)")
+
+            sections = [self._format_partial_summary(partial) for partial in partials]
+            while len(sections) > 1 and sum(len(section) for section in sections) > SUMMARY_DIRECT_CHARS:
+                # Partial summaries are still too long to merge at once; reduce them in groups first
+                partials = await self._map_summaries(self._group_for_summary(sections), semaphore, sections=True)
+                sections = [self._format_partial_summary(partial) for partial in partials]
+
+            result = await self._summarize_text("\n\n".join(sections), sections=True)
+            return {
+                'success': True,
+                **result,
+                'groups': len(groups),
+                'cached_groups': cached_groups
+            }
+
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse JSON response from DeepSeek: {e}")
+            return {
+                'success': False,
+                'message': "AI response was not in expected JSON format.",
+                'summary': "Could not generate summary.",
+                'key_points': []
+            }
         except Exception as e:
             logger.error(f"Error generating summary and key points: {e}")
             return {
@@ -271,6 +679,10 @@ class ProcessFactory:
                 "key_points": []
             }
 
+    def _format_partial_summary(self, partial: Dict) -> str:
+        key_points = "\n".join(f"- {point}" for point in partial.get('key_points', []))
+        return f"{partial.get('summary', '')}\nKey points:\n{key_points}"
+
     async def search_in_documents(self, query: str, user_id: str, user_documents: List[Dict] = None) -> Dict:
         """Search for specific content in user's documents"""
         try:
@@ -330,43 +742,9 @@ class ProcessFactory:
                 "user_id": user_id
             }
 
-    async def generate_questions_from_document(self, document_data: Dict, difficulty: str = "medium", num_questions: int = 3) -> Dict:
-        """Generate comprehension questions from document content"""
-        try:
-            logger.info(f"Generating {num_questions} questions from document")
-            
-            # Get document chunks
-            chunks = document_data.get('chunks', [])
-            if not chunks:
-                return {
-                    'success': False,
-                    'message': "No content available to generate questions from"
-                }
-            
-            # Select diverse chunks for questions (avoid consecutive paragraphs)
-            selected_chunks = []
-            chunk_indices = list(range(len(chunks)))
-            
-            # Select chunks with good spacing
-            for i in range(0, len(chunks), max(1, len(chunks) // (num_questions * 2))):
-                if len(selected_chunks) < num_questions and i < len(chunks):
-                    chunk = chunks[i]
-                    if len(chunk['text']) > 100:  # Ensure chunk has enough content
-                        selected_chunks.append(chunk)
-            
-            # If we don't have enough chunks, fill with remaining good chunks
-            while len(selected_chunks) < num_questions and len(selected_chunks) < len(chunks):
-                for chunk in chunks:
-                    if chunk not in selected_chunks and len(chunk['text']) > 100:
-                        selected_chunks.append(chunk)
-                        if len(selected_chunks) >= num_questions:
-                            break
-            
-            # Generate questions for each selected chunk
-            questions = []
-            
-            for i, chunk in enumerate(selected_chunks[:num_questions]):
-                prompt = f"""Based on the following text snippet, generate ONE {difficulty} difficulty comprehension question.
+    async def _generate_question_for_chunk(self, index: int, chunk: Dict, difficulty: str) -> Dict:
+        """One LLM call that turns a chunk into a single comprehension question"""
+        prompt = f"""Based on the following text snippet, generate ONE {difficulty} difficulty comprehension question.
 
     Text: "{chunk['text']}"
 
@@ -382,47 +760,210 @@ class ProcessFactory:
 
     The question should be specific enough that someone who read and understood this text could answer it, but not so obvious that it's just asking for a direct quote."""
 
-                # this is the message to send to deepseek
-                messages = [
-                    {"role": "system", "content": "You are an expert educator who creates thoughtful comprehension questions. Generate questions that test true understanding, not just memorization."},
-                    {"role": "user", "content": prompt}
-                ]
-                
-                response = await self.client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=300,
-                    response_format={"type": "json_object"}
-                )
-                
-                try:
-                    question_data = json.loads(response.choices[0].message.content.strip())
-                    
-                    question_id = f"q_{i+1}_{datetime.now().timestamp()}"
-                    questions.append({
-                        'id': question_id,
-                        'question': question_data.get('question', ''),
-                        'expected_answer': question_data.get('expected_answer', ''),
-                        'difficulty': difficulty,
-                        'question_type': question_data.get('question_type', 'comprehension'),
-                        'source_chunk': {
-                            'text': chunk['text'],
-                            'section': chunk['section'],
-                            'paragraph_index': chunk['paragraph_index'],
-                            'document': chunk['document']
-                        },
-                        'reference_section': chunk['section']
-                    })
-                    
-                except json.JSONDecodeError:
-                    logger.error(f"Failed to parse question JSON for chunk {i}")
-                    continue
+        # this is the message to send to deepseek
+        messages = [
+            {"role": "system", "content": "You are an expert educator who creates thoughtful comprehension questions. Generate questions that test true understanding, not just memorization."},
+            {"role": "user", "content": prompt}
+        ]
+        
+        response = await self._complete(
+            "question",
+            model="deepseek-chat",
+            messages=messages,
+            temperature=0.7,
+            max_tokens=300,
+            response_format={"type": "json_object"}
+        )
+        
+        question_data = json.loads(response.choices[0].message.content.strip())
+        return {
+            'question': self._build_question(index, question_data, chunk, difficulty),
+            'usage': self._usage_dict(response)
+        }
+
+    async def _generate_questions_batched(self, selected_chunks: List[Dict], difficulty: str) -> Dict:
+        """One JSON-mode LLM call that writes a question for every selected chunk"""
+        snippets = "\n\n".join(
+            f"[Snippet {i+1}]\n\"{chunk['text']}\"" for i, chunk in enumerate(selected_chunks)
+        )
+        prompt = f"""Based on each of the following {len(selected_chunks)} text snippets, generate ONE {difficulty} difficulty comprehension question per snippet.
+
+{snippets}
+
+    Each question should test understanding of the key concepts in its snippet.
+
+    Respond in JSON format:
+    {{
+        "questions": [
+            {{
+                "snippet": 1,
+                "question": "Your question here",
+                "expected_answer": "The key points that should be in a good answer",
+                "difficulty": "{difficulty}",
+                "question_type": "comprehension|analysis|application"
+            }}
+        ]
+    }}
+
+    Return exactly one entry per snippet, using the snippet number it was written from. Each question should be specific enough that someone who read and understood the snippet could answer it, but not so obvious that it's just asking for a direct quote."""
+
+        messages = [
+            {"role": "system", "content": "You are an expert educator who creates thoughtful comprehension questions. Generate questions that test true understanding, not just memorization."},
+            {"role": "user", "content": prompt}
+        ]
+        
+        response = await asyncio.wait_for(
+            self._complete(
+                "questions_batched",
+                model="deepseek-chat",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=min(300 * len(selected_chunks), 8000),
+                response_format={"type": "json_object"}
+            ),
+            timeout=QUESTION_TIMEOUT_SECONDS * 2
+        )
+        
+        parsed = json.loads(response.choices[0].message.content.strip())
+        questions = []
+        used_snippets = set()
+        for question_data in parsed.get('questions', []):
+            try:
+                position = int(question_data.get('snippet', 0)) - 1
+            except (TypeError, ValueError):
+                continue
+            # Map each question back to its source chunk; ignore duplicates and out-of-range numbers
+            if 0 <= position < len(selected_chunks) and position not in used_snippets:
+                used_snippets.add(position)
+                questions.append((position, self._build_question(position, question_data, selected_chunks[position], difficulty)))
+        
+        questions.sort(key=lambda item: item[0])
+        return {
+            'questions': [question for _, question in questions],
+            'failed': len(selected_chunks) - len(questions),
+            'usage': self._usage_dict(response)
+        }
+
+    def _usage_dict(self, response) -> Dict:
+        usage = getattr(response, 'usage', None)
+        return {
+            'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+            'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0
+        }
+
+    def _build_question(self, index: int, question_data: Dict, chunk: Dict, difficulty: str) -> Dict:
+        question_id = f"q_{index+1}_{datetime.now().timestamp()}"
+        return {
+            'id': question_id,
+            'question': question_data.get('question', ''),
+            'expected_answer': question_data.get('expected_answer', ''),
+            'difficulty': difficulty,
+            'question_type': question_data.get('question_type', 'comprehension'),
+            'source_chunk': {
+                'text': chunk['text'],
+                'section': chunk['section'],
+                'paragraph_index': chunk['paragraph_index'],
+                'document': chunk['document'],
+                'page': chunk.get('page')
+            },
+            'reference_section': chunk['section']
+        }
+
+    def _select_question_chunks(self, chunks: List[Dict], num_questions: int) -> List[Dict]:
+        """Pick well-spaced chunks with enough content to ask about"""
+        # Select diverse chunks for questions (avoid consecutive paragraphs)
+        selected_positions = []
+        
+        # Select chunks with good spacing
+        for i in range(0, len(chunks), max(1, len(chunks) // (num_questions * 2))):
+            if len(selected_positions) < num_questions and len(chunks[i]['text']) > 100:  # Ensure chunk has enough content
+                selected_positions.append(i)
+        
+        # If we don't have enough chunks, fill with remaining good chunks
+        if len(selected_positions) < num_questions:
+            taken = set(selected_positions)
+            for i, chunk in enumerate(chunks):
+                if len(selected_positions) >= num_questions:
+                    break
+                if i not in taken and len(chunk['text']) > 100:
+                    selected_positions.append(i)
+        
+        return [chunks[i] for i in selected_positions]
+
+    async def generate_questions_from_document(self, document_data: Dict, difficulty: str = "medium", num_questions: int = 3, mode: str = "parallel") -> Dict:
+        """Generate comprehension questions from document content.
+
+        "parallel" makes one LLM call per selected chunk, run concurrently (at
+        most QUESTION_CONCURRENCY at a time, each bounded by
+        QUESTION_TIMEOUT_SECONDS); calls that fail or time out are skipped and
+        the rest are returned. "batched" asks for every question in a single
+        JSON-mode call, which saves repeated prompt tokens on small quizzes.
+        """
+        try:
+            num_questions = max(1, min(num_questions or 3, MAX_QUESTIONS))
+            logger.info(f"Generating {num_questions} questions from document")
+            
+            # Get document chunks
+            chunks = document_data.get('chunks', [])
+            if not chunks:
+                return {
+                    'success': False,
+                    'message': "No content available to generate questions from"
+                }
+            
+            selected_chunks = self._select_question_chunks(chunks, num_questions)
+            
+            if mode == "batched":
+                batch_result = await self._generate_questions_batched(selected_chunks, difficulty)
+                return {
+                    'success': bool(batch_result['questions']),
+                    'questions': batch_result['questions'],
+                    'total_generated': len(batch_result['questions']),
+                    'total_failed': batch_result['failed'],
+                    'usage': batch_result['usage'],
+                    'mode': mode,
+                    'document_name': document_data.get('original_name', 'Unknown')
+                }
+            
+            semaphore = asyncio.Semaphore(QUESTION_CONCURRENCY)
+            
+            async def generate(index: int, chunk: Dict) -> Dict:
+                async with semaphore:
+                    return await asyncio.wait_for(
+                        self._generate_question_for_chunk(index, chunk, difficulty),
+                        timeout=QUESTION_TIMEOUT_SECONDS
+                    )
+            
+            results = await asyncio.gather(
+                *(generate(i, chunk) for i, chunk in enumerate(selected_chunks)),
+                return_exceptions=True
+            )
+            
+            questions = []
+            failed = 0
+            usage = {'prompt_tokens': 0, 'completion_tokens': 0}
+            for i, result in enumerate(results):
+                if isinstance(result, Exception):
+                    failed += 1
+                    logger.error(f"Failed to generate question for chunk {i}: {type(result).__name__}: {result}")
+                else:
+                    questions.append(result['question'])
+                    for key in usage:
+                        usage[key] += result['usage'][key]
+            
+            if not questions and failed:
+                return {
+                    'success': False,
+                    'message': f"Failed to generate questions: all {failed} question calls failed"
+                }
             
             return {
                 'success': True,
                 'questions': questions,
                 'total_generated': len(questions),
+                'total_failed': failed,
+                'usage': usage,
+                'mode': "parallel",
                 'document_name': document_data.get('original_name', 'Unknown')
             }
             
@@ -475,7 +1016,8 @@ class ProcessFactory:
                 {"role": "user", "content": prompt}
             ]
             
-            response = await self.client.chat.completions.create(
+            response = await self._complete(
+                "evaluation",
                 model="deepseek-chat",
                 messages=messages,
                 temperature=0.3,
@@ -504,52 +1046,34 @@ class ProcessFactory:
             }
         
     def extract_supporting_snippets(self, ai_response: str, context_chunks: List[Dict], max_snippets: int = 3) -> List[Dict]:
-        """Extract exact supporting text snippets from the document"""
+        """Extract exact supporting text snippets from the document.
+
+        Each chunk is aligned against the answer's sentences by word and
+        bigram overlap (services.alignment), in time linear in the text sizes.
+        """
         try:
             supporting_snippets = []
-            
-            # Extract potential quotes or references from AI response
-            # Look for phrases that might be paraphrased from the document
-            response_sentences = ai_response.split('. ')
+            sentences = response_sentences(ai_response)
             
             for chunk in context_chunks:
                 chunk_text = chunk['text']
-                best_match_score = 0
-                best_match_snippet = ""
-                best_sentence = ""
-                
-                # Check each sentence in the response against this chunk
-                for sentence in response_sentences:
-                    if len(sentence.strip()) < 20:  # Skip very short sentences
-                        continue
-                    
-                    # Use fuzzy matching to find similar content
-                    similarity = fuzz.partial_ratio(sentence.lower(), chunk_text.lower())
-                    
-                    if similarity > best_match_score and similarity > 60:  # Threshold for relevance
-                        best_match_score = similarity
-                        best_sentence = sentence.strip()
-                        
-                        # Find the most relevant snippet from the chunk
-                        words = sentence.lower().split()
-                        for i in range(len(chunk_text) - 100):
-                            snippet = chunk_text[i:i+200]
-                            snippet_similarity = fuzz.partial_ratio(' '.join(words[:5]), snippet.lower())
-                            if snippet_similarity > 70:
-                                best_match_snippet = snippet
-                                break
+                alignment = best_alignment(sentences, chunk_text)
                 
-                if best_match_score > 60:
+                if alignment:
+                    chunk_start = chunk.get('char_start', 0)
                     supporting_snippets.append({
-                        'snippet': best_match_snippet or chunk_text[:200] + "...",
+                        'snippet': chunk_text[alignment['char_start']:alignment['char_end']],
                         'full_text': chunk_text,
                         'section': chunk['section'],
                         'paragraph_index': chunk['paragraph_index'],
                         'document': chunk['document'],
-                        'confidence': best_match_score / 100.0,
-                        'ai_sentence': best_sentence,
-                        'char_start': chunk.get('char_start', 0),
-                        'char_end': chunk.get('char_end', len(chunk_text))
+                        'confidence': round(alignment['score'], 4),
+                        'ai_sentence': alignment['sentence'],
+                        'char_start': chunk_start,
+                        'char_end': chunk.get('char_end', len(chunk_text)),
+                        'snippet_start': chunk_start + alignment['char_start'],
+                        'snippet_end': chunk_start + alignment['char_end'],
+                        'page': chunk.get('page')
                     })
             
             # Sort by confidence and return top matches
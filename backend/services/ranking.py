@@ -0,0 +1,72 @@
+import heapq
+import math
+from typing import Dict, List, Tuple
+
+from services.search_index import InvertedIndex, tokenize
+
+
+class BM25Scorer:
+    """Okapi BM25 ranking over an InvertedIndex"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def idf(self, document_frequency: int, chunk_count: int) -> float:
+        # Lucene-style smoothing keeps the idf positive for very common terms
+        return math.log(1 + (chunk_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def score(self, index: InvertedIndex, query: str) -> Tuple[Dict, Dict, int]:
+        """Score every chunk that shares a term with the query.
+
+        Returns the raw scores keyed by chunk, how many query terms each
+        chunk matched, and the number of distinct query terms.
+        """
+        with index.lock:
+            query_terms = set(tokenize(query))
+            chunk_count = index.chunk_count
+            average_length = index.average_chunk_length or 1.0
+
+            scores: Dict = {}
+            matched_terms: Dict = {}
+            for term in query_terms:
+                postings = index.postings.get(term)
+                if not postings:
+                    continue
+
+                idf = self.idf(len(postings), chunk_count)
+                for key, term_frequency in postings.items():
+                    length_norm = 1 - self.b + self.b * index.chunk_lengths.get(key, 0) / average_length
+                    weight = term_frequency * (self.k1 + 1) / (term_frequency + self.k1 * length_norm)
+                    scores[key] = scores.get(key, 0.0) + idf * weight
+                    matched_terms[key] = matched_terms.get(key, 0) + 1
+
+            return scores, matched_terms, len(query_terms)
+
+    def top_k(self, index: InvertedIndex, query: str, k: int) -> Tuple[List[Dict], int]:
+        """Return the k best chunks (via a bounded heap) and the total candidate count"""
+        scores, matched_terms, query_term_count = self.score(index, query)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+        query_term_count = query_term_count or 1
+        with index.lock:
+            ranked = [
+                {
+                    **index.chunks[key],
+                    'chunk_key': key,
+                    'relevance_score': round(score, 4),
+                    'term_coverage': matched_terms[key] / query_term_count
+                }
+                for key, score in best
+                if key in index.chunks
+            ]
+        return ranked, len(scores)
+
+
+def reciprocal_rank_fusion(rankings: List[List], k: int = 60) -> List[Tuple]:
+    """Fuse several ranked key lists: each key scores sum(1 / (k + rank)) over the lists it appears in"""
+    fused: Dict = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,155 @@
+import re
+import threading
+import logging
+from typing import Dict, List, Tuple, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+MIN_TOKEN_LENGTH = 2
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers herself him himself his how i if in into is it its itself just me more most
+my myself no nor not now of off on once only or other our ours ourselves out over own same she should
+so some such than that the their theirs them themselves then there these they this those through to
+too under until up very was we were what when where which while who whom why will with would you your
+yours yourself yourselves tell explain describe please document documents
+""".split())
+
+ChunkKey = Tuple[str, int]  # (document id, position of the chunk in the document)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokenization used for both indexing and querying"""
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if len(token) >= MIN_TOKEN_LENGTH and token not in STOPWORDS
+    ]
+
+
+class InvertedIndex:
+    """Per-user inverted index mapping terms to the chunks that contain them.
+
+    Postings store term frequencies, and chunk lengths are kept alongside so
+    rankers can read document-frequency statistics without rescanning text.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[ChunkKey, int]] = {}
+        self.chunks: Dict[ChunkKey, Dict] = {}
+        self.chunk_lengths: Dict[ChunkKey, int] = {}
+        self.total_length = 0
+        self.document_terms: Dict[str, set] = {}
+        self.document_chunk_counts: Dict[str, int] = {}
+        self.lock = threading.RLock()
+
+    def has_document(self, document_id: str) -> bool:
+        return document_id in self.document_terms
+
+    def document_ids(self) -> List[str]:
+        return list(self.document_terms.keys())
+
+    def add_document(self, document_id: str, original_name: str, chunks: List[Dict]) -> None:
+        """Index every chunk of a document, replacing any previous version of it"""
+        with self.lock:
+            if document_id in self.document_terms:
+                self.remove_document(document_id)
+
+            terms = set()
+            for position, chunk in enumerate(chunks):
+                key = (document_id, position)
+                self.chunks[key] = {**chunk, 'original_doc': original_name}
+
+                tokens = tokenize(chunk.get('text', ''))
+                self.chunk_lengths[key] = len(tokens)
+                self.total_length += len(tokens)
+
+                for token in tokens:
+                    postings = self.postings.setdefault(token, {})
+                    postings[key] = postings.get(key, 0) + 1
+                    terms.add(token)
+
+            self.document_terms[document_id] = terms
+            self.document_chunk_counts[document_id] = len(chunks)
+
+    def remove_document(self, document_id: str) -> None:
+        """Drop a document's chunks and postings, touching only the terms it contains"""
+        with self.lock:
+            terms = self.document_terms.pop(document_id, None)
+            if terms is None:
+                return
+
+            chunk_count = self.document_chunk_counts.pop(document_id, 0)
+            keys = [(document_id, position) for position in range(chunk_count)]
+
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                for key in keys:
+                    postings.pop(key, None)
+                if not postings:
+                    del self.postings[term]
+
+            for key in keys:
+                self.chunks.pop(key, None)
+                self.total_length -= self.chunk_lengths.pop(key, 0)
+
+    def sync(self, documents: Iterable[Dict]) -> None:
+        """Bring the index in line with a document list by diffing document ids only"""
+        with self.lock:
+            current_ids = set()
+            for doc in documents:
+                document_id = doc.get('id')
+                if not document_id:
+                    continue
+                current_ids.add(document_id)
+                if not self.has_document(document_id) and doc.get('chunks'):
+                    self.add_document(document_id, doc.get('original_name', ''), doc['chunks'])
+
+            for stale_id in set(self.document_terms) - current_ids:
+                self.remove_document(stale_id)
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def average_chunk_length(self) -> float:
+        if not self.chunks:
+            return 0.0
+        return self.total_length / len(self.chunks)
+
+    def document_frequency(self, term: str) -> int:
+        return len(self.postings.get(term, ()))
+
+
+class IndexRegistry:
+    """Process-wide registry of per-user inverted indexes"""
+
+    def __init__(self):
+        self.indexes: Dict[str, InvertedIndex] = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_id: str) -> InvertedIndex:
+        with self.lock:
+            index = self.indexes.get(user_id)
+            if index is None:
+                index = InvertedIndex()
+                self.indexes[user_id] = index
+            return index
+
+    def add_document(self, user_id: str, document_data: Dict) -> None:
+        chunks = document_data.get('chunks')
+        if chunks:
+            self.get(user_id).add_document(document_data['id'], document_data.get('original_name', ''), chunks)
+
+    def remove_document(self, user_id: str, document_id: str) -> None:
+        index: Optional[InvertedIndex] = self.indexes.get(user_id)
+        if index is not None:
+            index.remove_document(document_id)
+
+
+index_registry = IndexRegistry()
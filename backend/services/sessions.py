@@ -0,0 +1,178 @@
+import os
+import uuid
+import asyncio
+import logging
+import weakref
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from services.tokens import CHARS_PER_TOKEN, estimate_tokens
+from services.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Tokens of verbatim conversation history that go into a chat prompt
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# Compaction keeps this much of the newest history verbatim, so it runs every few turns rather than every turn
+HISTORY_COMPACT_TO_TOKENS = HISTORY_TOKEN_BUDGET // 2
+SESSION_SUMMARY_MAX_TOKENS = int(os.getenv("SESSION_SUMMARY_MAX_TOKENS", "400"))
+
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators of one chat message
+LAST_TURN_MESSAGES = 2  # The latest question and answer always go into the prompt, cut down if need be
+TRUNCATION_MARKER = " [...]"
+
+
+def message_tokens(message: Dict) -> int:
+    return estimate_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _truncate(message: Dict, tokens: int) -> Dict:
+    """Keep the beginning of a message so it takes at most `tokens`"""
+    content = message.get("content", "")
+    if message_tokens(message) > tokens:
+        keep_chars = max(0, (tokens - MESSAGE_OVERHEAD_TOKENS) * CHARS_PER_TOKEN - len(TRUNCATION_MARKER))
+        content = content[:keep_chars] + TRUNCATION_MARKER
+    return {"role": message.get("role", "user"), "content": content}
+
+
+def fit_history(messages: List[Dict], token_budget: int = HISTORY_TOKEN_BUDGET) -> List[Dict]:
+    """The newest messages that fit in `token_budget`, oldest first.
+
+    The last turn is always included: if it alone exceeds the budget, the
+    budget is split between its messages (short ones keep their full text)
+    and the longer ones are cut, rather than dropping the whole history.
+    """
+    last_turn = messages[-LAST_TURN_MESSAGES:]
+    allowed = {}
+    remaining = token_budget
+    by_size = sorted(range(len(last_turn)), key=lambda i: message_tokens(last_turn[i]))
+    for done, i in enumerate(by_size):
+        allowed[i] = min(message_tokens(last_turn[i]), remaining // (len(by_size) - done))
+        remaining -= allowed[i]
+    fitted = [_truncate(message, allowed[i]) for i, message in enumerate(last_turn)]
+
+    older = []
+    for message in reversed(messages[:-LAST_TURN_MESSAGES]):
+        tokens = message_tokens(message)
+        if tokens > remaining:
+            break
+        older.append({"role": message.get("role", "user"), "content": message.get("content", "")})
+        remaining -= tokens
+    older.reverse()
+    return older + fitted
+
+
+def needs_compaction(messages: List[Dict]) -> bool:
+    """Whether unsummarized messages outgrew the budget with more than the last turn to fold"""
+    return (len(messages) > LAST_TURN_MESSAGES
+            and sum(message_tokens(message) for message in messages) > HISTORY_TOKEN_BUDGET)
+
+
+class ChatSessions:
+    """Server-side chat sessions with a rolling summary of older turns.
+
+    Messages are appended to storage with increasing sequence numbers. Once
+    the turns not yet summarized outgrow HISTORY_TOKEN_BUDGET, the oldest of
+    them are folded into the session's summary (by `summarize`, called with
+    the previous summary and the messages to fold) until only
+    HISTORY_COMPACT_TO_TOKENS remain. A prompt is the summary plus the
+    remaining turns, so its history stays bounded without dropping anything.
+    """
+
+    def __init__(self, storage, summarize: Callable[[str, List[Dict]], Awaitable[str]]):
+        self.storage = storage
+        self.summarize = summarize
+        self.compact_locks = weakref.WeakValueDictionary()
+        self.pending: Set[asyncio.Task] = set()
+
+    def _lock(self, locks: weakref.WeakValueDictionary, session_id: str) -> asyncio.Lock:
+        lock = locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            locks[session_id] = lock
+        return lock
+
+    async def create(self, user_id: str, document_id: str) -> Dict:
+        now = datetime.now().isoformat()
+        session = {
+            'id': str(uuid.uuid4()),
+            'document_id': document_id,
+            'summary': '',
+            'summarized_through': 0,  # Sequence number of the last message folded into the summary
+            'message_count': 0,
+            'created_at': now,
+            'updated_at': now
+        }
+        await run_blocking(self.storage.create_session, user_id, session)
+        return session
+
+    async def get(self, user_id: str, session_id: str) -> Optional[Dict]:
+        return await run_blocking(self.storage.get_session, user_id, session_id)
+
+    async def messages(self, user_id: str, session_id: str, after_seq: int = 0) -> List[Dict]:
+        return await run_blocking(self.storage.get_session_messages, user_id, session_id, after_seq)
+
+    async def delete(self, user_id: str, session_id: str) -> bool:
+        return await run_blocking(self.storage.delete_session, user_id, session_id)
+
+    async def prompt_history(self, user_id: str, session: Dict) -> Tuple[str, List[Dict]]:
+        """Summary and verbatim recent turns for the next prompt of a session"""
+        recent = await self.messages(user_id, session['id'], session['summarized_through'])
+        if needs_compaction(recent):
+            # A background compaction is still running or failed: finish it before building the prompt
+            if await self.compact(user_id, session['id']):
+                session = await self.get(user_id, session['id']) or session
+                recent = await self.messages(user_id, session['id'], session['summarized_through'])
+        return session['summary'], fit_history(recent)
+
+    async def record_turn(self, user_id: str, session_id: str, question: str, answer: str) -> None:
+        """Append a question and its answer, compacting older turns in the background if needed"""
+        now = datetime.now().isoformat()
+        turn = [
+            {'role': 'user', 'content': question, 'created_at': now},
+            {'role': 'assistant', 'content': answer, 'created_at': now}
+        ]
+        # Storage numbers the messages atomically, so workers answering the same session never collide
+        if await run_blocking(self.storage.append_session_messages, user_id, session_id, turn,
+                              {'updated_at': now}) is None:
+            return
+        session = await self.get(user_id, session_id)
+        if session is None:
+            return
+
+        recent = await self.messages(user_id, session_id, session['summarized_through'])
+        if needs_compaction(recent):
+            task = asyncio.create_task(self.compact(user_id, session_id))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def compact(self, user_id: str, session_id: str) -> bool:
+        """Fold the oldest unsummarized turns into the summary; returns False if summarizing failed"""
+        async with self._lock(self.compact_locks, session_id):
+            session = await self.get(user_id, session_id)
+            if session is None:
+                return False
+            recent = await self.messages(user_id, session_id, session['summarized_through'])
+            if not needs_compaction(recent):
+                return True  # Another request compacted while this one waited
+
+            keep = len(fit_history(recent, HISTORY_COMPACT_TO_TOKENS))
+            folded = recent[:len(recent) - keep]
+            try:
+                summary = await self.summarize(session['summary'], folded)
+            except Exception as e:
+                logger.warning(f"Could not compact chat session {session_id}: {e}")
+                return False
+
+            await run_blocking(self.storage.update_session, user_id, session_id, {
+                'summary': summary,
+                'summarized_through': folded[-1]['seq'],
+                'updated_at': datetime.now().isoformat()
+            })
+            logger.info(f"Compacted {len(folded)} messages of chat session {session_id} into its summary")
+            return True
+
+    async def aclose(self) -> None:
+        """Wait for compactions still running"""
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
@@ -0,0 +1,22 @@
+import os
+
+from services.storage.base import StorageBackend
+
+# "firestore" for production, "sqlite" to run the backend fully offline
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "navarya.db")
+
+
+def create_storage(db=None) -> StorageBackend:
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    if STORAGE_BACKEND == "sqlite":
+        from services.storage.sqlite_store import SQLiteStorage
+        return SQLiteStorage(SQLITE_PATH)
+
+    if db is None:
+        raise ValueError("Firestore storage requires an initialized Firestore client")
+    from services.storage.firestore_store import FirestoreStorage
+    return FirestoreStorage(db)
+
+
+__all__ = ["StorageBackend", "STORAGE_BACKEND", "create_storage"]
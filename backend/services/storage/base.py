@@ -0,0 +1,94 @@
+from typing import Dict, List, Optional
+
+
+class StorageBackend:
+    """Repository interface for everything main.py persists.
+
+    Documents are stored as a metadata record plus separately loaded content
+    (extracted text and chunks). Questions are the latest generated set per
+    user, and summaries are keyed by an opaque caller-chosen key. Chat
+    sessions are a record plus messages appended by sequence number.
+    """
+
+    # Documents
+
+    def save_document(self, user_id: str, document_data: Dict, only_if_exists: bool = False) -> bool:
+        """Write a document; with `only_if_exists`, returns False instead of recreating one deleted meanwhile"""
+        raise NotImplementedError
+
+    def list_documents(self, user_id: str) -> List[Dict]:
+        """Metadata for every document the user has, without text or chunks"""
+        raise NotImplementedError
+
+    def get_document(self, user_id: str, document_id: str, include_content: bool = True) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def get_document_content(self, user_id: str, metadata: Dict) -> Dict:
+        """Load text and chunks for a metadata record that was already fetched"""
+        raise NotImplementedError
+
+    def update_document(self, user_id: str, document_id: str, fields: Dict) -> None:
+        """Update metadata fields (summary, key points, ...) without touching content; KeyError if it is missing"""
+        raise NotImplementedError
+
+    def delete_document(self, user_id: str, document_id: str) -> Optional[Dict]:
+        """Delete a document and its content, returning its metadata"""
+        raise NotImplementedError
+
+    def get_documents(self, user_id: str, include_content: bool = False) -> List[Dict]:
+        documents = self.list_documents(user_id)
+        if include_content:
+            documents = [self.get_document_content(user_id, metadata) for metadata in documents]
+        return documents
+
+    # Chunks
+
+    def get_chunks(self, user_id: str, document_id: str) -> List[Dict]:
+        document = self.get_document(user_id, document_id)
+        return document.get('chunks', []) if document else []
+
+    # Questions
+
+    def save_questions(self, user_id: str, questions_data: Dict) -> None:
+        raise NotImplementedError
+
+    def get_questions(self, user_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    # Summaries
+
+    def save_summary(self, key: str, summary_data: Dict) -> None:
+        raise NotImplementedError
+
+    def get_summary(self, key: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    # Chat sessions
+
+    def create_session(self, user_id: str, session_data: Dict) -> None:
+        raise NotImplementedError
+
+    def get_session(self, user_id: str, session_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def update_session(self, user_id: str, session_id: str, fields: Dict) -> None:
+        """KeyError if the session is missing"""
+        raise NotImplementedError
+
+    def append_session_messages(self, user_id: str, session_id: str, messages: List[Dict],
+                                fields: Dict = None) -> Optional[List[Dict]]:
+        """Add messages after the last one of a session, atomically.
+
+        Each message gets the next 'seq' number, and the session's
+        'message_count' (plus any `fields`) is updated in the same
+        transaction, so concurrent writers never reuse a number. Returns the
+        numbered messages, or None if the session does not exist.
+        """
+        raise NotImplementedError
+
+    def get_session_messages(self, user_id: str, session_id: str, after_seq: int = 0) -> List[Dict]:
+        """Messages with a sequence number above `after_seq`, in order"""
+        raise NotImplementedError
+
+    def delete_session(self, user_id: str, session_id: str) -> bool:
+        raise NotImplementedError
@@ -0,0 +1,272 @@
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+from services.storage.base import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+# Firestore caps documents at 1 MiB; keep every record well under it even for multi-byte text
+TEXT_PART_CHARS = 200000
+CHUNK_BATCH_CHARS = 200000
+MAX_BATCH_WRITES = 400  # Firestore allows 500 writes per batch
+
+CONTENT_FIELDS = ('extracted_text', 'chunks')
+
+
+class FirestoreStorage(StorageBackend):
+    """Firestore storage backend.
+
+    Layout under user_documents/{user_id}:
+      documents/{document_id}                   metadata only
+      documents/{document_id}/text/{n}          extracted text, split into parts
+      documents/{document_id}/chunks/{n}        chunks, grouped into batches
+
+      sessions/{session_id}                     chat session record
+      sessions/{session_id}/messages/{seq}      one chat message each
+
+    Every write touches only the document being changed, and listing reads
+    only the metadata records. Questions live in user_questions/{user_id}
+    and summaries in document_summaries/{key}.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.migrated_users = set()
+
+    def _user_ref(self, user_id: str):
+        return self.db.collection('user_documents').document(user_id)
+
+    def _document_ref(self, user_id: str, document_id: str):
+        # Firestore ids cannot contain '/', which uploaded filenames occasionally do
+        return self._user_ref(user_id).collection('documents').document(document_id.replace('/', '_'))
+
+    def _migrate_legacy(self, user_id: str) -> None:
+        """Move documents out of the old single-array layout the first time a user is seen"""
+        if user_id in self.migrated_users:
+            return
+
+        user_doc = self._user_ref(user_id).get()
+        legacy_documents = user_doc.to_dict().get('documents') if user_doc.exists else None
+        if legacy_documents:
+            logger.info(f"Migrating {len(legacy_documents)} legacy documents for user {user_id}")
+            for document_data in legacy_documents:
+                self.save_document(user_id, document_data)
+            self._user_ref(user_id).set({
+                'documents': firestore.DELETE_FIELD,
+                'updated_at': datetime.now()
+            }, merge=True)
+
+        self.migrated_users.add(user_id)
+
+    def save_document(self, user_id: str, document_data: Dict, only_if_exists: bool = False) -> bool:
+        """Write one document's metadata, text parts and chunk batches"""
+        document_ref = self._document_ref(user_id, document_data['id'])
+        extracted_text = document_data.get('extracted_text') or ''
+        chunks = document_data.get('chunks') or []
+
+        text_parts = [
+            extracted_text[start:start + TEXT_PART_CHARS]
+            for start in range(0, len(extracted_text), TEXT_PART_CHARS)
+        ]
+
+        chunk_batches = []
+        current_batch, current_size = [], 0
+        for chunk in chunks:
+            chunk_size = len(chunk.get('text', ''))
+            if current_batch and current_size + chunk_size > CHUNK_BATCH_CHARS:
+                chunk_batches.append(current_batch)
+                current_batch, current_size = [], 0
+            current_batch.append(chunk)
+            current_size += chunk_size
+        if current_batch:
+            chunk_batches.append(current_batch)
+
+        metadata = {key: value for key, value in document_data.items() if key not in CONTENT_FIELDS}
+        metadata['has_text'] = bool(extracted_text)
+        metadata['total_chunks'] = len(chunks)
+        metadata['text_parts'] = len(text_parts)
+        metadata['chunk_batches'] = len(chunk_batches)
+
+        writes = [(document_ref.collection('text').document(str(i)), {'index': i, 'text': part})
+                  for i, part in enumerate(text_parts)]
+        writes += [(document_ref.collection('chunks').document(str(i)), {'index': i, 'chunks': batch})
+                   for i, batch in enumerate(chunk_batches)]
+        # Metadata goes last so a listed document always has its content in place
+        writes.append((document_ref, metadata))
+
+        try:
+            for start in range(0, len(writes), MAX_BATCH_WRITES):
+                batch = self.db.batch()
+                for ref, data in writes[start:start + MAX_BATCH_WRITES]:
+                    if ref is document_ref and only_if_exists:
+                        batch.update(ref, data)  # Fails the batch if the document was deleted meanwhile
+                    else:
+                        batch.set(ref, data)
+                batch.commit()
+        except NotFound:
+            # Content records written by earlier batches would otherwise be orphaned
+            refs = [ref for ref, _ in writes if ref is not document_ref]
+            for start in range(0, len(refs), MAX_BATCH_WRITES):
+                batch = self.db.batch()
+                for ref in refs[start:start + MAX_BATCH_WRITES]:
+                    batch.delete(ref)
+                batch.commit()
+            return False
+
+        self._user_ref(user_id).set({'updated_at': datetime.now()}, merge=True)
+        return True
+
+    def _load_content(self, user_id: str, metadata: Dict) -> Dict:
+        document_ref = self._document_ref(user_id, metadata['id'])
+        text_refs = [document_ref.collection('text').document(str(i)) for i in range(metadata.get('text_parts', 0))]
+        chunk_refs = [document_ref.collection('chunks').document(str(i)) for i in range(metadata.get('chunk_batches', 0))]
+
+        text_parts, chunk_batches = {}, {}
+        if text_refs or chunk_refs:
+            for snapshot in self.db.get_all(text_refs + chunk_refs):
+                if not snapshot.exists:
+                    continue
+                data = snapshot.to_dict()
+                if 'text' in data:
+                    text_parts[data['index']] = data['text']
+                else:
+                    chunk_batches[data['index']] = data['chunks']
+
+        chunks = []
+        for i in sorted(chunk_batches):
+            chunks.extend(chunk_batches[i])
+
+        return {
+            **metadata,
+            'extracted_text': ''.join(text_parts[i] for i in sorted(text_parts)),
+            'chunks': chunks
+        }
+
+    def list_documents(self, user_id: str) -> List[Dict]:
+        """Metadata for every document the user has, without text or chunks"""
+        self._migrate_legacy(user_id)
+        snapshots = self._user_ref(user_id).collection('documents').stream()
+        documents = [snapshot.to_dict() for snapshot in snapshots]
+        documents.sort(key=lambda doc: doc.get('uploaded_at', ''))
+        return documents
+
+    def get_document(self, user_id: str, document_id: str, include_content: bool = True) -> Optional[Dict]:
+        self._migrate_legacy(user_id)
+        snapshot = self._document_ref(user_id, document_id).get()
+        if not snapshot.exists:
+            return None
+        metadata = snapshot.to_dict()
+        return self._load_content(user_id, metadata) if include_content else metadata
+
+    def get_document_content(self, user_id: str, metadata: Dict) -> Dict:
+        """Load text and chunks for a metadata record that was already fetched"""
+        return self._load_content(user_id, metadata)
+
+    def update_document(self, user_id: str, document_id: str, fields: Dict) -> None:
+        """Update metadata fields (summary, key points, ...) without touching content"""
+        try:
+            self._document_ref(user_id, document_id).update(fields)
+        except NotFound:
+            raise KeyError(f"Document {document_id} not found")
+        self._user_ref(user_id).set({'updated_at': datetime.now()}, merge=True)
+
+    def delete_document(self, user_id: str, document_id: str) -> Optional[Dict]:
+        """Delete a document and its content records, returning its metadata"""
+        self._migrate_legacy(user_id)
+        document_ref = self._document_ref(user_id, document_id)
+        snapshot = document_ref.get()
+        if not snapshot.exists:
+            return None
+        metadata = snapshot.to_dict()
+
+        refs = [document_ref.collection('text').document(str(i)) for i in range(metadata.get('text_parts', 0))]
+        refs += [document_ref.collection('chunks').document(str(i)) for i in range(metadata.get('chunk_batches', 0))]
+        refs.append(document_ref)
+
+        for start in range(0, len(refs), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for ref in refs[start:start + MAX_BATCH_WRITES]:
+                batch.delete(ref)
+            batch.commit()
+
+        self._user_ref(user_id).set({'updated_at': datetime.now()}, merge=True)
+        return metadata
+
+    def save_questions(self, user_id: str, questions_data: Dict) -> None:
+        self.db.collection('user_questions').document(user_id).set(questions_data)
+
+    def get_questions(self, user_id: str) -> Optional[Dict]:
+        snapshot = self.db.collection('user_questions').document(user_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def save_summary(self, key: str, summary_data: Dict) -> None:
+        self.db.collection('document_summaries').document(key).set({
+            **summary_data,
+            'updated_at': datetime.now()
+        })
+
+    def get_summary(self, key: str) -> Optional[Dict]:
+        snapshot = self.db.collection('document_summaries').document(key).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def _session_ref(self, user_id: str, session_id: str):
+        return self._user_ref(user_id).collection('sessions').document(session_id)
+
+    def create_session(self, user_id: str, session_data: Dict) -> None:
+        self._session_ref(user_id, session_data['id']).set(session_data)
+
+    def get_session(self, user_id: str, session_id: str) -> Optional[Dict]:
+        snapshot = self._session_ref(user_id, session_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def update_session(self, user_id: str, session_id: str, fields: Dict) -> None:
+        try:
+            self._session_ref(user_id, session_id).update(fields)
+        except NotFound:
+            raise KeyError(f"Session {session_id} not found")
+
+    def append_session_messages(self, user_id: str, session_id: str, messages: List[Dict],
+                                fields: Dict = None) -> Optional[List[Dict]]:
+        session_ref = self._session_ref(user_id, session_id)
+        messages_ref = session_ref.collection('messages')
+
+        @firestore.transactional
+        def append(transaction):
+            # Retried by Firestore if another writer changed the session in between
+            snapshot = session_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            seq = (snapshot.to_dict() or {}).get('message_count', 0)
+            numbered = [{**message, 'seq': seq + i} for i, message in enumerate(messages, start=1)]
+            for message in numbered:
+                # Zero-padded ids keep the messages in order in the console as well
+                transaction.set(messages_ref.document(f"{message['seq']:010d}"), message)
+            transaction.update(session_ref, {**(fields or {}), 'message_count': seq + len(numbered)})
+            return numbered
+
+        return append(self.db.transaction())
+
+    def get_session_messages(self, user_id: str, session_id: str, after_seq: int = 0) -> List[Dict]:
+        query = (
+            self._session_ref(user_id, session_id).collection('messages')
+            .where('seq', '>', after_seq)
+            .order_by('seq')
+        )
+        return [snapshot.to_dict() for snapshot in query.stream()]
+
+    def delete_session(self, user_id: str, session_id: str) -> bool:
+        session_ref = self._session_ref(user_id, session_id)
+        if not session_ref.get().exists:
+            return False
+        refs = [snapshot.reference for snapshot in session_ref.collection('messages').stream()]
+        refs.append(session_ref)
+        for start in range(0, len(refs), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for ref in refs[start:start + MAX_BATCH_WRITES]:
+                batch.delete(ref)
+            batch.commit()
+        return True
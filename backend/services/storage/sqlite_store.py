@@ -0,0 +1,267 @@
+import json
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from services.storage.base import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    uploaded_at TEXT,
+    metadata TEXT NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE TABLE IF NOT EXISTS document_text (
+    user_id TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (user_id, document_id)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    user_id TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, document_id, position)
+);
+CREATE TABLE IF NOT EXISTS questions (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE TABLE IF NOT EXISTS session_messages (
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, session_id, seq)
+);
+"""
+
+CONTENT_FIELDS = ('extracted_text', 'chunks')
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=_json_default)
+
+
+class SQLiteStorage(StorageBackend):
+    """Local SQLite storage backend (WAL mode) for offline runs and benchmarks.
+
+    Mirrors the Firestore layout: document metadata, extracted text and
+    chunks live in separate tables, so listing never reads content.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets readers proceed while a writer commits
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def save_document(self, user_id: str, document_data: Dict, only_if_exists: bool = False) -> bool:
+        extracted_text = document_data.get('extracted_text') or ''
+        chunks = document_data.get('chunks') or []
+
+        metadata = {key: value for key, value in document_data.items() if key not in CONTENT_FIELDS}
+        metadata['has_text'] = bool(extracted_text)
+        metadata['total_chunks'] = len(chunks)
+
+        document_id = document_data['id']
+        with self._connection() as conn:
+            if only_if_exists:
+                # The UPDATE takes the write lock first, so a concurrent delete either wins outright or waits
+                updated = conn.execute(
+                    "UPDATE documents SET uploaded_at = ?, metadata = ? WHERE user_id = ? AND id = ?",
+                    (metadata.get('uploaded_at', ''), _dumps(metadata), user_id, document_id)
+                ).rowcount
+                if not updated:
+                    return False
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO documents (user_id, id, uploaded_at, metadata) VALUES (?, ?, ?, ?)",
+                    (user_id, document_id, metadata.get('uploaded_at', ''), _dumps(metadata))
+                )
+            conn.execute("DELETE FROM chunks WHERE user_id = ? AND document_id = ?", (user_id, document_id))
+            conn.execute(
+                "INSERT OR REPLACE INTO document_text (user_id, document_id, text) VALUES (?, ?, ?)",
+                (user_id, document_id, extracted_text)
+            )
+            conn.executemany(
+                "INSERT INTO chunks (user_id, document_id, position, data) VALUES (?, ?, ?, ?)",
+                [(user_id, document_id, position, _dumps(chunk)) for position, chunk in enumerate(chunks)]
+            )
+        return True
+
+    def list_documents(self, user_id: str) -> List[Dict]:
+        rows = self._connection().execute(
+            "SELECT metadata FROM documents WHERE user_id = ? ORDER BY uploaded_at", (user_id,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_document(self, user_id: str, document_id: str, include_content: bool = True) -> Optional[Dict]:
+        row = self._connection().execute(
+            "SELECT metadata FROM documents WHERE user_id = ? AND id = ?", (user_id, document_id)
+        ).fetchone()
+        if row is None:
+            return None
+        metadata = json.loads(row[0])
+        return self.get_document_content(user_id, metadata) if include_content else metadata
+
+    def get_document_content(self, user_id: str, metadata: Dict) -> Dict:
+        conn = self._connection()
+        text_row = conn.execute(
+            "SELECT text FROM document_text WHERE user_id = ? AND document_id = ?", (user_id, metadata['id'])
+        ).fetchone()
+        return {
+            **metadata,
+            'extracted_text': text_row[0] if text_row else '',
+            'chunks': self.get_chunks(user_id, metadata['id'])
+        }
+
+    def get_chunks(self, user_id: str, document_id: str) -> List[Dict]:
+        rows = self._connection().execute(
+            "SELECT data FROM chunks WHERE user_id = ? AND document_id = ? ORDER BY position", (user_id, document_id)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def update_document(self, user_id: str, document_id: str, fields: Dict) -> None:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT metadata FROM documents WHERE user_id = ? AND id = ?", (user_id, document_id)
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"Document {document_id} not found")
+            metadata = {**json.loads(row[0]), **fields}
+            conn.execute(
+                "UPDATE documents SET metadata = ? WHERE user_id = ? AND id = ?",
+                (_dumps(metadata), user_id, document_id)
+            )
+
+    def delete_document(self, user_id: str, document_id: str) -> Optional[Dict]:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT metadata FROM documents WHERE user_id = ? AND id = ?", (user_id, document_id)
+            ).fetchone()
+            if row is None:
+                return None
+            for table, column in (('documents', 'id'), ('document_text', 'document_id'), ('chunks', 'document_id')):
+                conn.execute(f"DELETE FROM {table} WHERE user_id = ? AND {column} = ?", (user_id, document_id))
+            return json.loads(row[0])
+
+    def save_questions(self, user_id: str, questions_data: Dict) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO questions (user_id, data) VALUES (?, ?)",
+                (user_id, _dumps(questions_data))
+            )
+
+    def get_questions(self, user_id: str) -> Optional[Dict]:
+        row = self._connection().execute("SELECT data FROM questions WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_summary(self, key: str, summary_data: Dict) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, data, updated_at) VALUES (?, ?, ?)",
+                (key, _dumps(summary_data), datetime.now().isoformat())
+            )
+
+    def get_summary(self, key: str) -> Optional[Dict]:
+        row = self._connection().execute("SELECT data FROM summaries WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def create_session(self, user_id: str, session_data: Dict) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO sessions (user_id, id, data) VALUES (?, ?, ?)",
+                (user_id, session_data['id'], _dumps(session_data))
+            )
+
+    def get_session(self, user_id: str, session_id: str) -> Optional[Dict]:
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE user_id = ? AND id = ?", (user_id, session_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_session(self, user_id: str, session_id: str, fields: Dict) -> None:
+        with self._connection() as conn:
+            # Take the write lock before reading, so concurrent updates of other fields are not lost
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE user_id = ? AND id = ?", (user_id, session_id)
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"Session {session_id} not found")
+            conn.execute(
+                "UPDATE sessions SET data = ? WHERE user_id = ? AND id = ?",
+                (_dumps({**json.loads(row[0]), **fields}), user_id, session_id)
+            )
+
+    def append_session_messages(self, user_id: str, session_id: str, messages: List[Dict],
+                                fields: Dict = None) -> Optional[List[Dict]]:
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE user_id = ? AND id = ?", (user_id, session_id)
+            ).fetchone()
+            if row is None:
+                return None
+            session = json.loads(row[0])
+            seq = session.get('message_count', 0)
+            numbered = [{**message, 'seq': seq + i} for i, message in enumerate(messages, start=1)]
+            conn.executemany(
+                "INSERT INTO session_messages (user_id, session_id, seq, data) VALUES (?, ?, ?, ?)",
+                [(user_id, session_id, message['seq'], _dumps(message)) for message in numbered]
+            )
+            conn.execute(
+                "UPDATE sessions SET data = ? WHERE user_id = ? AND id = ?",
+                (_dumps({**session, **(fields or {}), 'message_count': seq + len(numbered)}), user_id, session_id)
+            )
+            return numbered
+
+    def get_session_messages(self, user_id: str, session_id: str, after_seq: int = 0) -> List[Dict]:
+        rows = self._connection().execute(
+            "SELECT data FROM session_messages WHERE user_id = ? AND session_id = ? AND seq > ? ORDER BY seq",
+            (user_id, session_id, after_seq)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete_session(self, user_id: str, session_id: str) -> bool:
+        with self._connection() as conn:
+            deleted = conn.execute(
+                "DELETE FROM sessions WHERE user_id = ? AND id = ?", (user_id, session_id)
+            ).rowcount
+            conn.execute("DELETE FROM session_messages WHERE user_id = ? AND session_id = ?", (user_id, session_id))
+            return bool(deleted)
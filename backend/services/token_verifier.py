@@ -0,0 +1,133 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Callable, Dict, Optional
+
+import httpx
+from google.auth import jwt as google_jwt
+
+from services.cache import LRUCache
+from services.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+ID_TOKEN_CERT_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+CERT_REFRESH_MARGIN_SECONDS = 300  # Refresh this long before Google's Cache-Control max-age runs out
+CERT_RETRY_SECONDS = 60
+CLOCK_SKEW_SECONDS = 10
+
+
+class InvalidTokenError(ValueError):
+    pass
+
+
+class TokenVerifier:
+    """Firebase ID-token verification with a verified-token cache and in-memory signing certs.
+
+    Verified claims are cached under the token's SHA-256 until the token
+    expires, so repeat requests skip verification entirely. New tokens are
+    checked locally against Google's certs, which a background task keeps
+    fresh. Without a project id or certs it falls back to `fallback`
+    (firebase_admin's auth.verify_id_token) on the I/O pool.
+    """
+
+    def __init__(self, project_id: Optional[str], fallback: Callable[[str], Dict], http_client: httpx.AsyncClient = None):
+        self.project_id = project_id
+        self.fallback = fallback
+        self.http_client = http_client or httpx.AsyncClient(timeout=10)
+        self.verified = LRUCache(max_entries=TOKEN_CACHE_MAX_ENTRIES, ttl_seconds=3600)
+        self.certs: Dict[str, str] = {}
+        self.certs_expire_at = 0.0
+        self.certs_fetched_at = 0.0
+        self.cert_lock: Optional[asyncio.Lock] = None  # Created in start(), inside the running loop (Python 3.9 binds it at creation)
+        self.refresh_task: Optional[asyncio.Task] = None
+
+    async def refresh_certs(self) -> float:
+        """Fetch Google's signing certs; returns how long they may be cached"""
+        response = await self.http_client.get(ID_TOKEN_CERT_URL)
+        response.raise_for_status()
+        max_age = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+        ttl = float(max_age.group(1)) if max_age else 3600.0
+        self.certs = response.json()
+        self.certs_fetched_at = time.time()
+        self.certs_expire_at = self.certs_fetched_at + ttl
+        logger.info(f"Refreshed {len(self.certs)} Firebase signing certs, valid for {ttl:.0f}s")
+        return ttl
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                ttl = await self.refresh_certs()
+                delay = max(CERT_RETRY_SECONDS, ttl - CERT_REFRESH_MARGIN_SECONDS)
+            except Exception as e:
+                logger.warning(f"Could not refresh Firebase signing certs: {e}")
+                delay = CERT_RETRY_SECONDS
+            await asyncio.sleep(delay)
+
+    def start(self) -> None:
+        self.cert_lock = asyncio.Lock()
+        if self.project_id:
+            self.refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def aclose(self) -> None:
+        if self.refresh_task:
+            self.refresh_task.cancel()
+            await asyncio.gather(self.refresh_task, return_exceptions=True)
+        await self.http_client.aclose()
+
+    async def _ensure_certs(self) -> bool:
+        if self.certs and time.time() < self.certs_expire_at:
+            return True
+        async with self.cert_lock:
+            if not (self.certs and time.time() < self.certs_expire_at):
+                try:
+                    await self.refresh_certs()
+                except Exception as e:
+                    logger.warning(f"Could not fetch Firebase signing certs: {e}")
+        return bool(self.certs) and time.time() < self.certs_expire_at
+
+    def _key_id(self, token: str) -> Optional[str]:
+        try:
+            return google_jwt.decode_header(token).get('kid')
+        except ValueError as e:
+            raise InvalidTokenError(str(e))
+
+    def _verify_locally(self, token: str) -> Dict:
+        """The checks firebase_admin applies to ID tokens: signature, expiry, audience, issuer and subject"""
+        try:
+            claims = google_jwt.decode(token, certs=self.certs, audience=self.project_id,
+                                       clock_skew_in_seconds=CLOCK_SKEW_SECONDS)
+        except ValueError as e:
+            raise InvalidTokenError(str(e))
+
+        if claims.get('iss') != f"https://securetoken.google.com/{self.project_id}":
+            raise InvalidTokenError("Firebase ID token has incorrect issuer")
+        subject = claims.get('sub')
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise InvalidTokenError("Firebase ID token has invalid subject")
+        claims['uid'] = subject
+        return claims
+
+    async def verify(self, token: str) -> Dict:
+        token_key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        claims = self.verified.get(token_key)
+        if claims is not None:
+            return claims
+
+        if self.project_id and await self._ensure_certs():
+            if self._key_id(token) not in self.certs and time.time() - self.certs_fetched_at > CERT_RETRY_SECONDS:
+                # Google may have rotated its keys since the last refresh (at most one forced refresh a minute)
+                self.certs_expire_at = 0.0
+                await self._ensure_certs()
+            claims = self._verify_locally(token)
+        else:
+            claims = await run_blocking(self.fallback, token)
+
+        ttl = claims.get('exp', 0) - time.time()
+        if ttl > 0:
+            self.verified.set(token_key, claims, ttl=ttl)
+        return claims
@@ -0,0 +1,9 @@
+# DeepSeek's tokenizer averages roughly four characters of English per token
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for context budgeting without loading a tokenizer"""
+    if not text:
+        return 0
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
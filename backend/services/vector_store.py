@@ -0,0 +1,338 @@
+import os
+import re
+import json
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from services.embeddings import Embedder, get_embedder
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, so run a single worker there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "vector_store")
+IVF_MIN_ROWS = int(os.getenv("VECTOR_IVF_MIN_ROWS", "20000"))  # Brute force below this many vectors
+IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "8"))
+IVF_KMEANS_ITERATIONS = 10
+IVF_TRAINING_SAMPLE = 50000
+
+ChunkKey = Tuple[str, int]
+
+
+class IVFIndex:
+    """Inverted-file approximate index: k-means centroids with a row list per centroid"""
+
+    def __init__(self, nprobe: int = IVF_NPROBE):
+        self.nprobe = nprobe
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        self.built_rows = 0
+
+    def build(self, matrix: np.ndarray) -> None:
+        rows = matrix.shape[0]
+        nlist = max(1, int(np.sqrt(rows)))
+        rng = np.random.default_rng(0)
+
+        sample_ids = rng.choice(rows, size=min(rows, IVF_TRAINING_SAMPLE), replace=False)
+        sample = np.asarray(matrix[np.sort(sample_ids)])
+        centroids = sample[rng.choice(sample.shape[0], size=min(nlist, sample.shape[0]), replace=False)].copy()
+
+        for _ in range(IVF_KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(centroids.shape[0]):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+
+        # Assign every row in bounded batches so the mmap is streamed, not loaded
+        assignments = np.empty(rows, dtype=np.int32)
+        for start in range(0, rows, 65536):
+            block = np.asarray(matrix[start:start + 65536])
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        order = np.argsort(assignments, kind='stable')
+        boundaries = np.searchsorted(assignments[order], np.arange(centroids.shape[0] + 1))
+        self.lists = [order[boundaries[c]:boundaries[c + 1]] for c in range(centroids.shape[0])]
+        self.centroids = centroids
+        self.built_rows = rows
+
+    def candidates(self, query: np.ndarray, total_rows: int) -> np.ndarray:
+        """Rows in the nprobe closest lists plus any rows appended after the last build"""
+        closest = np.argsort(-(self.centroids @ query))[:self.nprobe]
+        parts = [self.lists[c] for c in closest]
+        if total_rows > self.built_rows:
+            parts.append(np.arange(self.built_rows, total_rows))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+class VectorStore:
+    """Per-user chunk vectors kept as one contiguous, memory-mapped float32 matrix.
+
+    Rows are appended at upload and tombstoned on delete; the file is compacted
+    once tombstones outnumber live rows. Worker processes share the files:
+    writes hold an exclusive flock on the directory's lock file and searches
+    a shared one. Every metadata write bumps a generation counter kept in the
+    lock file, and a process reloads the metadata whenever the counter moved
+    since it last read or wrote it.
+    """
+
+    def __init__(self, directory: str, embedder: Embedder):
+        self.directory = directory
+        self.embedder = embedder
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.lock = threading.RLock()
+        self.lock_depth = 0
+        self.generation = 0
+
+        self.rows: List[List] = []  # row -> [document id, chunk position]
+        self.documents: Dict[str, List[int]] = {}  # document id -> [first row, end row)
+        self.deleted_rows: set = set()
+        self.matrix: Optional[np.ndarray] = None
+        self.live_mask: Optional[np.ndarray] = None
+        self.ivf: Optional[IVFIndex] = None
+
+        os.makedirs(directory, exist_ok=True)
+        self.lock_fd = os.open(os.path.join(directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked(exclusive=True):
+            self._load(reset_on_mismatch=True)
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        """Thread lock plus a cross-process flock; nested calls reuse the outer flock"""
+        with self.lock:
+            if self.lock_depth == 0 and fcntl is not None:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self.lock_depth += 1
+            try:
+                if self.lock_depth == 1:
+                    self._refresh()
+                yield
+            finally:
+                self.lock_depth -= 1
+                if self.lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def _stored_generation(self) -> int:
+        if fcntl is None:
+            return self.generation
+        return int.from_bytes(os.pread(self.lock_fd, 8, 0), "little")
+
+    def _refresh(self) -> None:
+        """Reload metadata another process wrote since we last read or wrote it"""
+        if self._stored_generation() != self.generation:
+            self._load()
+
+    def _load(self, reset_on_mismatch: bool = False) -> None:
+        self.rows, self.documents, self.deleted_rows = [], {}, set()
+        self.ivf = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if meta.get('embedder') == self.embedder.name and meta.get('dimension') == self.embedder.dimension:
+                self.rows = meta['rows']
+                self.documents = meta['documents']
+                self.deleted_rows = set(meta['deleted_rows'])
+            elif reset_on_mismatch:
+                logger.info(f"Embedder changed for {self.directory}, discarding stored vectors")
+                self._reset_files()
+            else:
+                logger.warning(f"Vectors in {self.directory} were written with another embedder, ignoring them")
+        self.generation = self._stored_generation()
+        self._open_matrix()
+
+    def _reset_files(self) -> None:
+        for path in (self.vectors_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.rows, self.documents, self.deleted_rows = [], {}, set()
+
+    def _open_matrix(self) -> None:
+        self.live_mask = None
+        if self.rows:
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                    shape=(len(self.rows), self.embedder.dimension))
+        else:
+            self.matrix = None
+
+    def _save_meta(self) -> None:
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'embedder': self.embedder.name,
+                'dimension': self.embedder.dimension,
+                'rows': self.rows,
+                'documents': self.documents,
+                'deleted_rows': sorted(self.deleted_rows)
+            }, f)
+        os.replace(tmp_path, self.meta_path)
+        self.generation = self._stored_generation() + 1
+        if fcntl is not None:
+            os.pwrite(self.lock_fd, self.generation.to_bytes(8, "little"), 0)
+
+    def has_document(self, document_id: str) -> bool:
+        with self._locked(exclusive=False):
+            return document_id in self.documents
+
+    def add_document(self, document_id: str, chunks: List[Dict], vectors: np.ndarray = None) -> None:
+        """Embed a document's chunks once and append them to the matrix"""
+        with self._locked(exclusive=True):
+            if document_id in self.documents:
+                self.remove_document(document_id)
+            if not chunks:
+                return
+
+            if vectors is None:
+                vectors = self.embedder.embed([chunk.get('text', '') for chunk in chunks])
+            start = len(self.rows)
+            if os.path.exists(self.vectors_path):
+                # Drop any tail left by a write that never made it into the metadata
+                os.truncate(self.vectors_path, start * self.embedder.dimension * 4)
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+
+            self.rows.extend([document_id, position] for position in range(len(chunks)))
+            self.documents[document_id] = [start, len(self.rows)]
+            self._save_meta()
+            self._open_matrix()
+
+    def remove_document(self, document_id: str) -> None:
+        with self._locked(exclusive=True):
+            row_range = self.documents.pop(document_id, None)
+            if row_range is None:
+                return
+            self.deleted_rows.update(range(row_range[0], row_range[1]))
+
+            if len(self.deleted_rows) * 2 > len(self.rows):
+                self.compact()
+            else:
+                self._save_meta()
+                self.live_mask = None
+
+    def compact(self) -> None:
+        """Rewrite the matrix without tombstoned rows"""
+        with self._locked(exclusive=True):
+            live = [row for row in range(len(self.rows)) if row not in self.deleted_rows]
+            tmp_path = self.vectors_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                for start in range(0, len(live), 65536):
+                    ids = live[start:start + 65536]
+                    f.write(np.ascontiguousarray(self.matrix[ids], dtype=np.float32).tobytes())
+
+            self.matrix = None
+            os.replace(tmp_path, self.vectors_path)
+
+            remap = {old: new for new, old in enumerate(live)}
+            self.rows = [self.rows[old] for old in live]
+            self.documents = {
+                doc_id: [remap[start], remap[end - 1] + 1]
+                for doc_id, (start, end) in self.documents.items()
+            }
+            self.deleted_rows = set()
+            self.ivf = None
+            self._save_meta()
+            self._open_matrix()
+
+    def sync(self, documents: Iterable[Dict]) -> None:
+        """Embed documents that predate the store.
+
+        Deletions go through remove_document only: every worker shares the
+        store, and a worker's (cached) document list can be older than another
+        worker's upload, so an id missing from it is not proof of deletion.
+        """
+        with self._locked(exclusive=False):
+            missing = [doc for doc in documents
+                       if doc.get('id') and doc.get('chunks') and doc['id'] not in self.documents]
+        if not missing:
+            return
+        with self._locked(exclusive=True):
+            for doc in missing:
+                if doc['id'] not in self.documents:
+                    self.add_document(doc['id'], doc['chunks'])
+
+    def _live(self) -> np.ndarray:
+        if self.live_mask is None:
+            mask = np.ones(len(self.rows), dtype=bool)
+            if self.deleted_rows:
+                mask[list(self.deleted_rows)] = False
+            self.live_mask = mask
+        return self.live_mask
+
+    def search(self, query_vector: np.ndarray, k: int) -> List[Tuple[ChunkKey, float]]:
+        """Cosine top-k: exact dot product, or IVF candidates once the store is large"""
+        with self._locked(exclusive=False):
+            if self.matrix is None or k <= 0:
+                return []
+
+            total_rows = len(self.rows)
+            if total_rows - len(self.deleted_rows) >= IVF_MIN_ROWS:
+                if self.ivf is None or total_rows > self.ivf.built_rows * 1.5:
+                    self.ivf = IVFIndex()
+                    self.ivf.build(self.matrix)
+                candidates = self.ivf.candidates(query_vector, total_rows)
+                candidates = np.sort(candidates[self._live()[candidates]])
+                scores = np.asarray(self.matrix[candidates]) @ query_vector
+            else:
+                scores = np.asarray(self.matrix) @ query_vector
+                scores[~self._live()] = -np.inf
+                candidates = np.arange(total_rows)
+
+            k = min(k, len(candidates))
+            if k == 0:
+                return []
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+
+            results = []
+            for position in best:
+                if not np.isfinite(scores[position]):
+                    continue
+                document_id, chunk_position = self.rows[candidates[position]]
+                results.append(((document_id, chunk_position), float(scores[position])))
+            return results
+
+
+class VectorStoreRegistry:
+    """Process-wide registry of per-user vector stores sharing one embedder"""
+
+    def __init__(self, root: str = VECTOR_STORE_DIR):
+        self.root = root
+        self.stores: Dict[str, VectorStore] = {}
+        self.lock = threading.Lock()
+        self._embedder: Optional[Embedder] = None
+
+    @property
+    def embedder(self) -> Embedder:
+        if self._embedder is None:
+            self._embedder = get_embedder()
+        return self._embedder
+
+    def get(self, user_id: str) -> VectorStore:
+        with self.lock:
+            store = self.stores.get(user_id)
+            if store is None:
+                safe_user_id = re.sub(r"[^A-Za-z0-9_-]", "_", user_id)
+                store = VectorStore(os.path.join(self.root, safe_user_id), self.embedder)
+                self.stores[user_id] = store
+            return store
+
+    def add_document(self, user_id: str, document_data: Dict, vectors: np.ndarray = None) -> None:
+        chunks = document_data.get('chunks')
+        if chunks:
+            self.get(user_id).add_document(document_data['id'], chunks, vectors=vectors)
+
+    def remove_document(self, user_id: str, document_id: str) -> None:
+        self.get(user_id).remove_document(document_id)
+
+
+vector_registry = VectorStoreRegistry()